@@ -0,0 +1,99 @@
+import os
+import time
+import urllib.request
+from io import BytesIO
+
+from impresora import ImpresoraVirtual
+from cache_imagenes import CacheRaster, CacheImagenesUrl
+from detalle import Texto, Imagen, ImagenUrl, Logo, Qr, CodigoBarras, Corte
+
+# Salto de línea después de imágenes, QR y códigos de barras
+SIN_OPCIONES = {}
+
+
+# Convierte el detalle de un comprobante (las instrucciones ya interpretadas
+# de app-get-comprobante.php, ver detalle.py) en los bytes ESC/POS listos
+# para mandar. Tiene sus propias caches de imágenes; en memoria son por
+# proceso y en disco se comparten, así que funciona igual en el hilo del
+# procesador que en un proceso de armado.
+class ArmadorComprobantes:
+    def __init__(self, url_base, reintentos=None):
+        self.url_base = url_base
+        # Logo e imágenes repetidas ya rasterizadas al ancho de la impresora
+        self.cache_raster = CacheRaster()
+        # Imágenes de las líneas #url#, con sesión HTTP compartida
+        self.cache_url = CacheImagenesUrl(reintentos=reintentos)
+        self._logo = None
+
+    # Devuelve (bytes, segundos que llevó armarlo)
+    def armar(self, instrucciones, destino):
+        inicio = time.perf_counter()
+        datos = self.compilar(instrucciones, destino)
+        return datos, time.perf_counter() - inicio
+
+    # Arma el comprobante completo en memoria y devuelve los bytes ESC/POS
+    def compilar(self, instrucciones, destino):
+        impresora = ImpresoraVirtual(destino['ancho'], destino['perfil'], destino['tramado'])
+        for instruccion in instrucciones:
+            tipo = type(instruccion)
+            if tipo is Texto:
+                impresora.imprimir_texto(instruccion.texto, instruccion.opciones)
+            elif tipo is Imagen:
+                # Suelen ser QR fiscales distintos en cada comprobante: solo en memoria
+                self.imprimir_imagen_cacheada(impresora, instruccion.datos, persistir=False)
+                impresora.imprimir_texto("\r\n", SIN_OPCIONES)
+            elif tipo is ImagenUrl:
+                imagen_binaria = self.cache_url.obtener(instruccion.url)
+                if imagen_binaria is None:
+                    raise RuntimeError(f"No se pudo descargar la imagen {instruccion.url}")
+                self.imprimir_imagen_cacheada(impresora, imagen_binaria)
+            elif tipo is Logo:
+                self.imprimir_imagen_cacheada(impresora, self.leer_logo())
+            elif tipo is Qr:
+                impresora.imprimir_qr(instruccion.contenido)
+                impresora.imprimir_texto("\r\n", SIN_OPCIONES)
+            elif tipo is CodigoBarras:
+                impresora.imprimir_codigo_barras(instruccion.tipo, instruccion.datos)
+                impresora.imprimir_texto("\r\n", SIN_OPCIONES)
+            elif tipo is Corte:
+                impresora.cortar()
+        impresora.cortar()
+        return impresora.obtener_bytes()
+
+    # Usa el raster guardado si la misma imagen ya se imprimió con este ancho, perfil y tramado
+    def imprimir_imagen_cacheada(self, impresora, imagen_binaria, persistir=True):
+        clave = CacheRaster.clave(imagen_binaria, impresora.ancho_impresora, impresora.perfil, impresora.tramado)
+        datos = self.cache_raster.obtener(clave)
+        if datos is None:
+            from PIL import Image
+            datos = impresora.rasterizar_imagen(Image.open(BytesIO(imagen_binaria)))
+            self.cache_raster.guardar(clave, datos, persistir)
+        impresora.enviar(datos)
+
+    # Contenido de logo.jpg; solo se vuelve a leer si el archivo cambió
+    def leer_logo(self):
+        if not os.path.exists("logo.jpg"):
+            url_imagen = self.url_base + "app/logo.jpg"
+            # Con varios procesos de armado más de uno puede bajarlo a la vez
+            temporal = f"logo.jpg.{os.getpid()}.tmp"
+            urllib.request.urlretrieve(url_imagen, temporal)
+            os.replace(temporal, "logo.jpg")
+        estado = os.stat("logo.jpg")
+        firma = (estado.st_mtime_ns, estado.st_size)
+        if self._logo is None or self._logo[0] != firma:
+            with open("logo.jpg", 'rb') as archivo:
+                self._logo = (firma, archivo.read())
+        return self._logo[1]
+
+
+# Armador de cada proceso del pool de armado (ver ProcesadorComprobantes)
+_armador = None
+
+
+def iniciar_proceso_armado(url_base):
+    global _armador
+    _armador = ArmadorComprobantes(url_base)
+
+
+def armar_en_proceso(instrucciones, destino):
+    return _armador.armar(instrucciones, destino)
@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from reintentos import PlanificadorReintentos
+
+CARPETA_CACHE = 'cache_imagenes'
+# Recorrer la carpeta para podarla cuesta un stat por archivo, así que no se
+# hace en cada imagen guardada: cada cache lleva la cuenta de lo que escribió
+# desde la última pasada y vuelve a recorrerla al llegar al tope o, como la
+# carpeta la comparten los procesos de armado, cada PODAR_CADA imágenes.
+PODAR_CADA = 50
+# Al podar se baja hasta esta fracción del tope, así las imágenes siguientes
+# no vuelven a pasarlo enseguida
+FRACCION_PODA = 0.9
+
+
+# Lo que hay en la carpeta de una cache (archivos o bytes) según la última
+# pasada de _podar, más lo que este proceso escribió desde entonces.
+# `sumar` dice si toca volver a recorrerla; hasta la primera pasada, siempre.
+class CuentaDisco:
+    def __init__(self, tope):
+        self.tope = tope
+        self.total = None
+        self.guardados = 0
+        self._lock = threading.Lock()
+
+    def sumar(self, cantidad):
+        with self._lock:
+            self.guardados += 1
+            if self.total is not None:
+                self.total += cantidad
+                if self.total <= self.tope and self.guardados < PODAR_CADA:
+                    return False
+            self.guardados = 0
+            return True
+
+    def medido(self, total):
+        with self._lock:
+            self.total = total
+
+
+# Cache de imágenes ya rasterizadas (bytes ESC/POS listos para mandar).
+# La clave incluye el hash del contenido, el ancho, el perfil de la
+# impresora y el tramado, así que si cambia logo.jpg o config.ini la entrada
+# vieja simplemente deja de usarse.
+class CacheRaster:
+    def __init__(self, carpeta=os.path.join(CARPETA_CACHE, 'raster'), max_memoria=32, max_archivos=500):
+        self.carpeta = carpeta
+        self.max_memoria = max_memoria
+        self.max_archivos = max_archivos
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._en_disco = CuentaDisco(max_archivos)
+
+    @staticmethod
+    def clave(contenido, ancho, perfil, tramado=None):
+        hash_contenido = hashlib.sha256(contenido).hexdigest()
+        return hashlib.sha256(f"{hash_contenido}:{ancho}:{perfil or 'default'}:{tramado or ''}".encode()).hexdigest()
+
+    def obtener(self, clave):
+        with self._lock:
+            datos = self._memoria.get(clave)
+            if datos is not None:
+                self._memoria.move_to_end(clave)
+                return datos
+        try:
+            with open(self._ruta(clave), 'rb') as archivo:
+                datos = archivo.read()
+        except OSError:
+            return None
+        self._recordar(clave, datos)
+        return datos
+
+    # `persistir=False` la deja solo en memoria (imágenes que rara vez se repiten)
+    def guardar(self, clave, datos, persistir=True):
+        self._recordar(clave, datos)
+        if not persistir:
+            return
+        try:
+            os.makedirs(self.carpeta, exist_ok=True)
+            ruta = self._ruta(clave)
+            temporal = f"{ruta}.{threading.get_ident()}.tmp"
+            with open(temporal, 'wb') as archivo:
+                archivo.write(datos)
+            os.replace(temporal, ruta)
+            if self._en_disco.sumar(1):
+                self._en_disco.medido(self._podar())
+        except OSError as e:
+            # Sin disco la cache sigue funcionando en memoria
+            logging.error(f"No se pudo guardar la imagen en la cache: {e}")
+
+    def _recordar(self, clave, datos):
+        with self._lock:
+            self._memoria[clave] = datos
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+
+    def _ruta(self, clave):
+        return os.path.join(self.carpeta, f"{clave}.bin")
+
+    # Borra los archivos más viejos cuando se supera el máximo. Devuelve
+    # cuántos quedaron.
+    def _podar(self):
+        archivos = [e for e in os.scandir(self.carpeta) if e.name.endswith('.bin')]
+        if len(archivos) <= self.max_archivos:
+            return len(archivos)
+        quedan = int(self.max_archivos * FRACCION_PODA)
+        archivos.sort(key=lambda e: e.stat().st_mtime)
+        for entrada in archivos[:len(archivos) - quedan]:
+            try:
+                os.remove(entrada.path)
+            except OSError:
+                pass
+        return quedan
+
+
+# Cache HTTP para las imágenes de las líneas #url#.
+# Una sola sesión con conexiones reutilizables, LRU en memoria y copia en
+# disco con tope de tamaño. Pasada la vigencia se revalida con
+# If-None-Match / If-Modified-Since; un 304 reutiliza lo guardado.
+# Un solo intento por pedido, sin esperas: si el servidor de la imagen viene
+# fallando, su disyuntor corta en el acto y el comprobante se reintenta
+# más tarde (ver reintentos.py).
+class CacheImagenesUrl:
+    def __init__(self, carpeta=os.path.join(CARPETA_CACHE, 'url'), max_memoria=32,
+                 max_bytes_disco=50 * 1024 * 1024, vigencia=300, timeout=10, reintentos=None):
+        self.reintentos = reintentos if reintentos is not None else PlanificadorReintentos()
+        self.carpeta = carpeta
+        self.max_memoria = max_memoria
+        self.max_bytes_disco = max_bytes_disco
+        self.vigencia = vigencia
+        self.timeout = timeout
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._en_disco = CuentaDisco(max_bytes_disco)
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.session.mount('http://', adaptador)
+        self.session.mount('https://', adaptador)
+
+    # Devuelve el contenido de la imagen (bytes) o None si no se pudo obtener
+    def obtener(self, url):
+        entrada = self._leer(url)
+        if entrada is not None and time.time() - entrada['validado'] < self.vigencia:
+            return entrada['contenido']
+
+        disyuntor = self.reintentos.disyuntor(f"imágenes de {urlparse(url).netloc}")
+        if not disyuntor.permitir():
+            # Mejor una imagen vieja que frenar el comprobante
+            return entrada['contenido'] if entrada is not None else None
+
+        encabezados = {}
+        if entrada is not None:
+            if entrada.get('etag'):
+                encabezados['If-None-Match'] = entrada['etag']
+            if entrada.get('last_modified'):
+                encabezados['If-Modified-Since'] = entrada['last_modified']
+
+        revalidada = False
+        try:
+            response = self.session.get(url, headers=encabezados, timeout=self.timeout)
+            if response.status_code == 304 and entrada is not None:
+                entrada['validado'] = time.time()
+                revalidada = True
+            else:
+                response.raise_for_status()
+                entrada = {
+                    'contenido': response.content,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'validado': time.time(),
+                }
+        except requests.exceptions.RequestException as e:
+            disyuntor.fallo()
+            if entrada is not None:
+                logging.error(f"Error al revalidar la imagen {url}: {e}. Se usa la copia guardada.")
+                return entrada['contenido']
+            logging.error(f"Error al descargar la imagen desde la URL: {e}")
+            return None
+        disyuntor.exito()
+        if revalidada:
+            self._guardar_metadatos(url, entrada)
+        else:
+            self._guardar(url, entrada)
+        return entrada['contenido']
+
+    def _leer(self, url):
+        with self._lock:
+            entrada = self._memoria.get(url)
+            if entrada is not None:
+                self._memoria.move_to_end(url)
+                return entrada
+        base = self._ruta(url)
+        try:
+            with open(base + '.json', 'r') as archivo:
+                entrada = json.load(archivo)
+            with open(base + '.bin', 'rb') as archivo:
+                entrada['contenido'] = archivo.read()
+        except (OSError, ValueError):
+            return None
+        self._recordar(url, entrada)
+        return entrada
+
+    def _guardar(self, url, entrada):
+        self._recordar(url, entrada)
+        base = self._ruta(url)
+        sufijo = f".{threading.get_ident()}.tmp"
+        metadatos = {clave: valor for clave, valor in entrada.items() if clave != 'contenido'}
+        try:
+            os.makedirs(self.carpeta, exist_ok=True)
+            with open(base + '.bin' + sufijo, 'wb') as archivo:
+                archivo.write(entrada['contenido'])
+            with open(base + '.json' + sufijo, 'w') as archivo:
+                json.dump(metadatos, archivo)
+            os.replace(base + '.bin' + sufijo, base + '.bin')
+            os.replace(base + '.json' + sufijo, base + '.json')
+            if self._en_disco.sumar(len(entrada['contenido'])):
+                self._en_disco.medido(self._podar())
+        except OSError as e:
+            logging.error(f"No se pudo guardar la imagen en la cache: {e}")
+
+    # 304: la imagen no cambió. Solo se reescribe el .json y se marca el .bin
+    # como recién usado (para _podar), sin copiarlo ni recorrer la carpeta.
+    def _guardar_metadatos(self, url, entrada):
+        self._recordar(url, entrada)
+        base = self._ruta(url)
+        temporal = base + f".json.{threading.get_ident()}.tmp"
+        metadatos = {clave: valor for clave, valor in entrada.items() if clave != 'contenido'}
+        try:
+            with open(temporal, 'w') as archivo:
+                json.dump(metadatos, archivo)
+            os.replace(temporal, base + '.json')
+            os.utime(base + '.bin')
+        except OSError as e:
+            logging.error(f"No se pudo actualizar la imagen en la cache: {e}")
+
+    def _recordar(self, url, entrada):
+        with self._lock:
+            self._memoria[url] = entrada
+            self._memoria.move_to_end(url)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+
+    def _ruta(self, url):
+        return os.path.join(self.carpeta, hashlib.sha256(url.encode()).hexdigest())
+
+    # Mantiene la carpeta por debajo de max_bytes_disco, borrando lo menos usado
+    def _podar(self):
+        archivos = [e for e in os.scandir(self.carpeta) if e.name.endswith('.bin')]
+        total = sum(e.stat().st_size for e in archivos)
+        if total <= self.max_bytes_disco:
+            return total
+        archivos.sort(key=lambda e: e.stat().st_mtime)
+        for entrada in archivos:
+            if total <= self.max_bytes_disco * FRACCION_PODA:
+                break
+            total -= entrada.stat().st_size
+            for ruta in (entrada.path, entrada.path[:-4] + '.json'):
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+        return total
@@ -0,0 +1,110 @@
+import logging
+import threading
+
+from metricas import metricas
+
+# Cada cuánto se mira si la impresora volvió a aparecer en el bus USB
+INTERVALO_HOTPLUG = 1
+# Pausa después de un envío fallido con la impresora presente (sin papel, tapa abierta)
+ESPERA_TRAS_FALLO = 2
+# Aunque nadie avise, cada tanto se revisa la cola por si quedó algo
+INTERVALO_COLA = 5
+
+
+# Consumidor de la cola de impresión persistente (el diario) de una impresora.
+# El procesador descarga y arma los comprobantes aunque la impresora no esté;
+# este hilo los va mandando en orden. Si la impresora se desconecta, espera a
+# que vuelva a aparecer en el USB y sigue vaciando la cola en el momento,
+# sin esperar el ciclo de error. Hay una por impresora configurada, cada una
+# con su hilo, así una impresora trabada o sin papel no frena a las demás.
+class ColaImpresion:
+    def __init__(self, sesion_impresora, diario, eventos, nombre='impresora'):
+        self.sesion_impresora = sesion_impresora
+        self.diario = diario
+        self.eventos = eventos
+        self.nombre = nombre
+        self._hilo = None
+        self._detener = threading.Event()
+        self._hay_trabajo = threading.Event()
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._correr, name=f"cola-{self.nombre}", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        self._hay_trabajo.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    # Llamado por el procesador cuando encola un comprobante
+    def avisar(self):
+        self._hay_trabajo.set()
+
+    def _correr(self):
+        while not self._detener.is_set():
+            trabajo = self.diario.siguiente_en_cola(self.nombre)
+            if trabajo is None:
+                self._hay_trabajo.wait(INTERVALO_COLA)
+                self._hay_trabajo.clear()
+                continue
+
+            try:
+                impresora = self.sesion_impresora.obtener()
+            except RuntimeError as e:
+                self.esperar_impresora(e)
+                continue
+
+            numero_completo, datos = trabajo
+            if not self.imprimir(numero_completo, datos, impresora):
+                self._detener.wait(ESPERA_TRAS_FALLO)
+
+    # Sondea el bus USB hasta que la impresora reaparece
+    def esperar_impresora(self, error):
+        error_str = str(error)
+        if "device not found" in error_str.lower():
+            mensaje_error = "Impresora no conectada."
+        else:
+            mensaje_error = f"Error al conectar con la impresora: {error_str}"
+        self._mostrar(f"{self.nombre}: {mensaje_error} {self.diario.en_cola(self.nombre)} comprobantes en cola.", 'error')
+        while not self._detener.is_set():
+            if self.sesion_impresora.presente():
+                return
+            self._detener.wait(INTERVALO_HOTPLUG)
+
+    def imprimir(self, numero_completo, datos, impresora):
+        metricas.comprobante_actual(numero_completo)
+        # pendiente -> enviando queda en disco antes de tocar la impresora
+        if not self.diario.iniciar_envio(numero_completo):
+            logging.info(f"Comprobante {numero_completo} ya enviado a la impresora, no se repite.")
+            return True
+
+        try:
+            # Todo el comprobante sale en una sola escritura (o pocas, por bloques)
+            impresora.enviar(datos)
+            self.diario.confirmar_impresion(numero_completo)
+        except RuntimeError as e:
+            self.diario.marcar_fallido(numero_completo)
+            # Conexión caída o timeout de escritura: se reabre en el próximo comprobante
+            self.sesion_impresora.invalidar(str(e))
+            mensaje_error = f"Error en la impresora {self.nombre}: {e}, comprobante: {numero_completo}"
+            logging.error(mensaje_error)
+            self._mostrar(mensaje_error, 'error')
+            return False
+        except Exception as e:
+            self.diario.marcar_fallido(numero_completo)
+            mensaje_error = f"Error al imprimir comprobante {numero_completo}: {e}"
+            logging.error(mensaje_error)
+            self._mostrar(mensaje_error, 'error')
+            return False
+
+        logging.info(f"Comprobante {numero_completo} impreso y registrado en el diario.")
+        self._mostrar(f"Comprobante procesado: {numero_completo}", 'exito')
+        self.eventos.put(('impreso', numero_completo))
+        return True
+
+    def _mostrar(self, mensaje, tipo):
+        self.eventos.put((tipo, mensaje))
@@ -0,0 +1,64 @@
+import os
+import logging
+import threading
+
+# Cada cuánto se mira si config.ini cambió
+INTERVALO_CONFIGURACION = 2
+
+
+def firma_archivo(ruta):
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    return estado.st_mtime_ns, estado.st_size
+
+
+# Vigila config.ini comparando fecha de modificación y tamaño (un stat cada
+# INTERVALO_CONFIGURACION segundos, sin dependencias). Cuando cambia lo lee y
+# valida con `leer` en este mismo hilo; si está bien se lo pasa a `al_cambiar`,
+# si no avisa con `al_fallar` y se sigue con la configuración que estaba.
+# Un archivo a medio guardar falla la validación y se vuelve a leer con el
+# próximo cambio.
+class VigilanteConfiguracion:
+    def __init__(self, ruta, leer, al_cambiar, al_fallar=None, intervalo=INTERVALO_CONFIGURACION):
+        self.ruta = ruta
+        self.leer = leer
+        self.al_cambiar = al_cambiar
+        self.al_fallar = al_fallar
+        self.intervalo = intervalo
+        # Se toma antes de la primera lectura, así no se pierde un cambio hecho en el medio
+        self.firma = firma_archivo(ruta)
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._correr, name="vigilante-configuracion", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def _correr(self):
+        while not self._detener.wait(self.intervalo):
+            self.revisar()
+
+    def revisar(self):
+        firma = firma_archivo(self.ruta)
+        if firma is None or firma == self.firma:
+            return
+        self.firma = firma
+        try:
+            configuracion = self.leer(self.ruta)
+        except Exception as e:
+            mensaje_error = f"config.ini tiene un error, se sigue con la configuración anterior: {e}"
+            logging.error(mensaje_error)
+            if self.al_fallar is not None:
+                self.al_fallar(mensaje_error)
+            return
+        self.al_cambiar(configuracion)
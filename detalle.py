@@ -0,0 +1,224 @@
+import re
+import base64
+import hashlib
+import binascii
+
+# Cuánto se lee de la respuesta por vez
+TAMANO_TROZO = 64 * 1024
+
+# Formato de app-get-comprobante.php: una instrucción por línea, separadas por \r\n.
+#   B;<alto>;<texto>       texto (B = negrita, cualquier otra cosa = normal)
+#   #img#<base64>          imagen en la misma línea (QR fiscal, firmas)
+#   #url#<url>             imagen a descargar (se guarda en la cache)
+#   #logo#                 logo.jpg del comercio
+#   #qr#<contenido>        QR generado por la impresora
+#   #barcode#<tipo>;<datos>
+#   #fin#                  corte de papel
+# La marca puede estar en cualquier parte de la línea y el argumento llega
+# hasta el final o hasta otra aparición de la misma marca, como siempre se leyó.
+DIRECTIVA = re.compile(rb'#(img|url|logo|qr|barcode|fin)#')
+
+# Lo que se muestra de una línea inválida en el mensaje de error
+LARGO_MUESTRA = 60
+
+
+# Una línea del detalle que no respeta el formato. Es un ValueError, así que
+# sigue el mismo camino que cualquier error de armado: el comprobante queda
+# fallido en el diario y se reintenta.
+class LineaInvalida(ValueError):
+    def __init__(self, numero, motivo, linea):
+        muestra = linea[:LARGO_MUESTRA]
+        if isinstance(muestra, bytes):
+            muestra = muestra.decode('utf-8', 'replace')
+        if len(linea) > LARGO_MUESTRA:
+            muestra += f"... ({len(linea)} caracteres)"
+        super().__init__(f"línea {numero} del comprobante: {motivo}: '{muestra}'")
+        self.numero = numero
+
+
+# Instrucciones ya interpretadas, en el orden en que se imprimen
+class Texto:
+    __slots__ = ('texto', 'opciones')
+
+    def __init__(self, texto, opciones):
+        self.texto = texto
+        self.opciones = opciones
+
+
+class Imagen:
+    __slots__ = ('datos',)
+
+    def __init__(self, datos):
+        self.datos = datos
+
+
+class ImagenUrl:
+    __slots__ = ('url',)
+
+    def __init__(self, url):
+        self.url = url
+
+
+class Logo:
+    __slots__ = ()
+
+
+class Qr:
+    __slots__ = ('contenido',)
+
+    def __init__(self, contenido):
+        self.contenido = contenido
+
+
+class CodigoBarras:
+    __slots__ = ('tipo', 'datos')
+
+    def __init__(self, tipo, datos):
+        self.tipo = tipo
+        self.datos = datos
+
+
+class Corte:
+    __slots__ = ()
+
+
+# Las opciones de texto se repiten en casi todas las líneas: un solo dict por (negrita, alto)
+_opciones_texto = {}
+
+
+def opciones_texto(negrita, alto):
+    clave = (negrita, alto)
+    opciones = _opciones_texto.get(clave)
+    if opciones is None:
+        opciones = _opciones_texto[clave] = {
+            "align": u'left',
+            "font": u'a',
+            "height": alto + 5,
+            "bold": negrita,
+        }
+    return opciones
+
+
+# Interpreta una línea (bytes, sin el \r\n). Devuelve la instrucción o None
+# si la línea está vacía; si no respeta el formato lanza LineaInvalida.
+def interpretar_linea(linea, numero, codificacion):
+    if not linea:
+        return None
+    directiva = DIRECTIVA.search(linea)
+    if directiva is None:
+        campos = linea.decode(codificacion, 'replace').split(';')
+        if len(campos) < 3:
+            raise LineaInvalida(numero, "se esperaba 'B;alto;texto'", linea)
+        try:
+            alto = int(campos[1])
+        except ValueError:
+            raise LineaInvalida(numero, f"alto de texto inválido '{campos[1]}'", linea)
+        return Texto(campos[2], opciones_texto(campos[0] == "B", alto))
+
+    nombre = directiva.group(1)
+    fin = linea.find(directiva.group(0), directiva.end())
+    argumento = linea[directiva.end():fin if fin >= 0 else len(linea)]
+    if nombre == b'img':
+        try:
+            # Directo de los bytes recibidos a la imagen, sin pasar por str
+            return Imagen(base64.b64decode(argumento))
+        except binascii.Error as e:
+            raise LineaInvalida(numero, f"imagen en base64 inválida ({e})", linea)
+    if nombre == b'logo':
+        return Logo()
+    if nombre == b'fin':
+        return Corte()
+    argumento = argumento.decode(codificacion, 'replace')
+    if nombre == b'url':
+        if not argumento.strip():
+            raise LineaInvalida(numero, "falta la URL de la imagen", linea)
+        return ImagenUrl(argumento)
+    if nombre == b'qr':
+        return Qr(argumento)
+    if ';' not in argumento:
+        raise LineaInvalida(numero, "se esperaba '#barcode#tipo;datos'", linea)
+    tipo, datos = argumento.split(';', 1)
+    return CodigoBarras(tipo, datos)
+
+
+# Corta en líneas (\r\n) lo que va llegando de la respuesta, sin juntarla
+# entera antes. Como str.split, la última línea sale aunque esté vacía.
+def separar_lineas(trozos):
+    resto = bytearray()
+    for trozo in trozos:
+        if not trozo:
+            continue
+        # El \r pudo haber quedado al final del trozo anterior
+        buscar = max(0, len(resto) - 1)
+        resto += trozo
+        inicio = 0
+        while True:
+            fin = resto.find(b'\r\n', buscar)
+            if fin < 0:
+                break
+            yield bytes(resto[inicio:fin])
+            inicio = buscar = fin + 2
+        del resto[:inicio]
+    yield bytes(resto)
+
+
+# Detalle de un comprobante: las instrucciones interpretadas y el cuerpo
+# tal como llegó, que es lo que se guarda en el diario. Si alguna línea no
+# respeta el formato, `error` tiene la LineaInvalida y no hay instrucciones.
+class DetalleComprobante:
+    __slots__ = ('cuerpo', 'codificacion', 'instrucciones', 'error', 'lineas')
+
+    def __init__(self, codificacion='utf-8'):
+        self.cuerpo = bytearray()
+        self.codificacion = codificacion
+        self.instrucciones = []
+        self.error = None
+        self.lineas = 0
+
+    def agregar(self, linea):
+        if self.lineas:
+            self.cuerpo += b'\r\n'
+        self.cuerpo += linea
+        self.lineas += 1
+        if self.error is not None:
+            return
+        try:
+            instruccion = interpretar_linea(linea, self.lineas, self.codificacion)
+        except LineaInvalida as e:
+            self.error = e
+            self.instrucciones = None
+            return
+        if instruccion is not None:
+            self.instrucciones.append(instruccion)
+
+    # Las instrucciones para armarlo; si el detalle vino mal, la LineaInvalida
+    def validas(self):
+        if self.error is not None:
+            raise self.error
+        return self.instrucciones
+
+    def texto(self):
+        return self.cuerpo.decode(self.codificacion, 'replace')
+
+    # Para el registro, en lugar del cuerpo con las imágenes en base64
+    def resumen(self):
+        huella = hashlib.sha1(self.cuerpo).hexdigest()[:12]
+        if self.error is not None:
+            contenido = "con errores"
+        else:
+            imagenes = sum(1 for instruccion in self.instrucciones if isinstance(instruccion, (Imagen, ImagenUrl)))
+            contenido = f"{imagenes} imágenes"
+        return f"{self.lineas} líneas, {len(self.cuerpo)} bytes, {contenido}, sha1 {huella}"
+
+
+def leer_detalle(lineas, codificacion='utf-8'):
+    detalle = DetalleComprobante(codificacion)
+    for linea in lineas:
+        detalle.agregar(linea)
+    return detalle
+
+
+# Lee la respuesta de app-get-comprobante.php de a trozos y la interpreta a
+# medida que llega
+def leer_respuesta(response):
+    return leer_detalle(separar_lineas(response.iter_content(TAMANO_TROZO)), response.encoding or 'utf-8')
@@ -0,0 +1,249 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+ARCHIVO_DIARIO = 'comprobantes.db'
+
+# Estados de un comprobante en el diario:
+# pendiente -> enviando -> impreso, o fallido si el envío dio error.
+# Los pendientes/fallidos que ya tienen `datos` (bytes ESC/POS armados) forman
+# la cola de impresión, que sobrevive a reinicios y desconexiones.
+# 'enviando' se graba con fsync ANTES de mandar los bytes a la impresora; si
+# el programa se corta en el medio, al arrancar queda en ese estado y
+# `recuperar` lo resuelve.
+PENDIENTE = 'pendiente'
+ENVIANDO = 'enviando'
+IMPRESO = 'impreso'
+FALLIDO = 'fallido'
+
+# Límite de parámetros por consulta (SQLite viejos aceptan 999)
+TAMANO_CONSULTA = 500
+
+
+# Diario de impresión en SQLite (modo WAL). Reemplaza al control por
+# archivo de comprobantes_guardados: un índice por numero_completo y otro
+# por idcomprobante, con estado, fechas y el cuerpo del comprobante.
+# Cada cambio de estado es una transacción con fsync (synchronous=FULL) y
+# solo avanza desde el estado esperado, así un comprobante no se manda dos
+# veces a la impresora.
+class DiarioImpresion:
+    def __init__(self, ruta=ARCHIVO_DIARIO, carpeta_anterior=None):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=FULL")
+        self._conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS comprobantes (
+                numero_completo TEXT PRIMARY KEY,
+                idcomprobante TEXT,
+                estado TEXT NOT NULL,
+                creado REAL NOT NULL,
+                actualizado REAL NOT NULL,
+                detalle TEXT,
+                datos BLOB,
+                impresora TEXT
+            );
+            CREATE INDEX IF NOT EXISTS comprobantes_id ON comprobantes (idcomprobante);
+            CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+        """)
+        columnas = {fila[1] for fila in self._conexion.execute("PRAGMA table_info(comprobantes)")}
+        if 'datos' not in columnas:
+            self._conexion.execute("ALTER TABLE comprobantes ADD COLUMN datos BLOB")
+        if 'impresora' not in columnas:
+            self._conexion.execute("ALTER TABLE comprobantes ADD COLUMN impresora TEXT")
+        # Lo impreso que todavía tiene el cuerpo guardado, para compactarlo (retencion.py)
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS comprobantes_compactar ON comprobantes (creado) "
+            "WHERE detalle IS NOT NULL AND estado = 'impreso'")
+        # Lo impreso por fecha, para borrar lo vencido (retencion.py). Reemplaza
+        # al índice por fecha de todos los estados, que ya no usa ninguna consulta.
+        self._conexion.execute("DROP INDEX IF EXISTS comprobantes_creado")
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS comprobantes_antiguos ON comprobantes (creado) WHERE estado = 'impreso'")
+        # Lo impreso por orden de impresión, para la lista de la interfaz
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS comprobantes_impresos ON comprobantes (actualizado) WHERE estado = 'impreso'")
+        # Una cola por impresora
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS comprobantes_cola ON comprobantes (impresora, creado) "
+            "WHERE datos IS NOT NULL AND estado IN ('pendiente', 'fallido')")
+        if carpeta_anterior is not None:
+            self.migrar_carpeta(carpeta_anterior)
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+    def _ejecutar(self, sql, parametros=()):
+        with self._lock:
+            return self._conexion.execute(sql, parametros).fetchall()
+
+    # Devuelve los comprobantes del listado que todavía no se imprimieron
+    # ni están esperando en la cola
+    def nuevos(self, comprobantes):
+        numeros = list({c.get('numero_completo', '') for c in comprobantes})
+        resueltos = set()
+        for inicio in range(0, len(numeros), TAMANO_CONSULTA):
+            parte = numeros[inicio:inicio + TAMANO_CONSULTA]
+            marcas = ','.join('?' * len(parte))
+            filas = self._ejecutar(
+                f"SELECT numero_completo FROM comprobantes "
+                f"WHERE (estado IN (?, ?) OR datos IS NOT NULL) AND numero_completo IN ({marcas})",
+                [IMPRESO, ENVIANDO] + parte)
+            resueltos.update(fila[0] for fila in filas)
+        return [c for c in comprobantes if c.get('numero_completo', '') not in resueltos]
+
+    # Impreso, en camino a la impresora o en la cola: no hay que volver a armarlo
+    def resuelto(self, numero_completo):
+        filas = self._ejecutar("SELECT 1 FROM comprobantes WHERE numero_completo = ? "
+                               "AND (estado IN (?, ?) OR datos IS NOT NULL)",
+                               (numero_completo, IMPRESO, ENVIANDO))
+        return bool(filas)
+
+    # Deja el comprobante armado en la cola de la impresora indicada.
+    # `detalle` es el cuerpo tal como llegó del servidor.
+    def encolar(self, numero_completo, idcomprobante, detalle, datos, impresora):
+        ahora = time.time()
+        self._ejecutar("""
+            INSERT INTO comprobantes (numero_completo, idcomprobante, estado, creado, actualizado, detalle, datos, impresora)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (numero_completo) DO UPDATE SET
+                estado = excluded.estado,
+                actualizado = excluded.actualizado,
+                detalle = excluded.detalle,
+                datos = excluded.datos,
+                impresora = excluded.impresora
+            WHERE comprobantes.estado NOT IN (?, ?)
+        """, (numero_completo, str(idcomprobante), PENDIENTE, ahora, ahora, detalle,
+              datos, impresora, ENVIANDO, IMPRESO))
+
+    # Próximo comprobante a imprimir, en orden de llegada: (numero_completo, datos)
+    def siguiente_en_cola(self, impresora):
+        filas = self._ejecutar("SELECT numero_completo, datos FROM comprobantes "
+                               "WHERE impresora = ? AND datos IS NOT NULL AND estado IN ('pendiente', 'fallido') "
+                               "ORDER BY creado, rowid LIMIT 1", (impresora,))
+        return tuple(filas[0]) if filas else None
+
+    def en_cola(self, impresora):
+        return self._ejecutar("SELECT COUNT(*) FROM comprobantes "
+                              "WHERE impresora = ? AND datos IS NOT NULL AND estado IN ('pendiente', 'fallido')",
+                              (impresora,))[0][0]
+
+    # Alta o actualización como pendiente/fallido. Nunca pisa un comprobante
+    # que ya está enviándose o impreso.
+    def registrar(self, numero_completo, idcomprobante, estado, detalle=None):
+        ahora = time.time()
+        self._ejecutar("""
+            INSERT INTO comprobantes (numero_completo, idcomprobante, estado, creado, actualizado, detalle)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (numero_completo) DO UPDATE SET
+                idcomprobante = excluded.idcomprobante,
+                estado = excluded.estado,
+                actualizado = excluded.actualizado,
+                detalle = COALESCE(excluded.detalle, comprobantes.detalle)
+            WHERE comprobantes.estado NOT IN (?, ?)
+        """, (numero_completo, str(idcomprobante), estado, ahora, ahora, detalle, ENVIANDO, IMPRESO))
+
+    def _cambiar_estado(self, numero_completo, desde, hacia):
+        marcas = ','.join('?' * len(desde))
+        # Una vez impreso ya no hace falta guardar los bytes
+        datos = ", datos = NULL" if hacia == IMPRESO else ""
+        with self._lock:
+            cursor = self._conexion.execute(
+                f"UPDATE comprobantes SET estado = ?, actualizado = ?{datos} "
+                f"WHERE numero_completo = ? AND estado IN ({marcas})",
+                (hacia, time.time(), numero_completo, *desde))
+            return cursor.rowcount == 1
+
+    # Toma el comprobante para imprimirlo. False si ya lo tomó otro envío.
+    def iniciar_envio(self, numero_completo):
+        return self._cambiar_estado(numero_completo, (PENDIENTE, FALLIDO), ENVIANDO)
+
+    def confirmar_impresion(self, numero_completo):
+        return self._cambiar_estado(numero_completo, (ENVIANDO,), IMPRESO)
+
+    # El envío dio error: se vuelve a intentar en el próximo ciclo
+    def marcar_fallido(self, numero_completo):
+        return self._cambiar_estado(numero_completo, (ENVIANDO,), FALLIDO)
+
+    # Resuelve lo que quedó 'enviando' por un corte. No se puede saber si la
+    # impresora llegó a imprimirlo, así que se decide siempre igual: por
+    # defecto se da por impreso (evita duplicados en el mostrador); con
+    # `reimprimir=True` vuelve a pendiente. Devuelve los numero_completo.
+    def recuperar(self, reimprimir=False):
+        destino = PENDIENTE if reimprimir else IMPRESO
+        with self._lock:
+            with self._conexion:
+                self._conexion.execute("BEGIN IMMEDIATE")
+                filas = self._conexion.execute("SELECT numero_completo FROM comprobantes WHERE estado = ?",
+                                               (ENVIANDO,)).fetchall()
+                datos = "datos" if reimprimir else "NULL"
+                self._conexion.execute(f"UPDATE comprobantes SET estado = ?, actualizado = ?, datos = {datos} "
+                                       f"WHERE estado = ?", (destino, time.time(), ENVIANDO))
+        return [fila[0] for fila in filas]
+
+    # Borra hasta `cantidad` comprobantes impresos registrados antes de
+    # `limite` (timestamp). Los pendientes y fallidos son la cola de
+    # impresión y no se borran por viejos. Devuelve cuántos borró.
+    def eliminar_antiguos(self, limite, cantidad=500):
+        with self._lock:
+            cursor = self._conexion.execute(
+                "DELETE FROM comprobantes WHERE rowid IN "
+                "(SELECT rowid FROM comprobantes WHERE estado = 'impreso' AND creado < ? ORDER BY creado LIMIT ?)",
+                (limite, cantidad))
+            return cursor.rowcount
+
+    # Impresos antes de `limite` que todavía guardan el cuerpo, los más viejos
+    # primero: [(numero_completo, idcomprobante, creado, detalle)]
+    def para_compactar(self, limite, cantidad=500):
+        return self._ejecutar("SELECT numero_completo, idcomprobante, creado, detalle FROM comprobantes "
+                              "WHERE detalle IS NOT NULL AND estado = 'impreso' AND creado < ? "
+                              "ORDER BY creado LIMIT ?", (limite, cantidad))
+
+    # El cuerpo ya quedó en el archivo comprimido: en el diario solo queda la fila
+    def compactados(self, numeros):
+        with self._lock:
+            with self._conexion:
+                self._conexion.execute("BEGIN")
+                self._conexion.executemany("UPDATE comprobantes SET detalle = NULL WHERE numero_completo = ?",
+                                           [(numero,) for numero in numeros])
+
+    def cantidad_impresos(self):
+        return self._ejecutar("SELECT COUNT(*) FROM comprobantes WHERE estado = 'impreso'")[0][0]
+
+    # Una página de lo impreso, lo último primero: [(numero_completo, actualizado, impresora)]
+    def impresos(self, desde, cantidad):
+        return self._ejecutar("SELECT numero_completo, actualizado, impresora FROM comprobantes "
+                              "WHERE estado = 'impreso' ORDER BY actualizado DESC LIMIT ? OFFSET ?",
+                              (cantidad, desde))
+
+    def migrado(self):
+        return bool(self._ejecutar("SELECT 1 FROM meta WHERE clave = 'migrado'"))
+
+    # Importa una sola vez los .txt de la carpeta que se usaba antes como control
+    def migrar_carpeta(self, carpeta):
+        if self._ejecutar("SELECT 1 FROM meta WHERE clave = 'migrado'") or not os.path.isdir(carpeta):
+            return
+        filas = []
+        for entrada in os.scandir(carpeta):
+            if not entrada.is_file() or not entrada.name.endswith('.txt'):
+                continue
+            fecha = entrada.stat().st_mtime
+            try:
+                with open(entrada.path, 'r') as archivo:
+                    detalle = archivo.read()
+            except (OSError, UnicodeDecodeError):
+                detalle = None
+            filas.append((entrada.name[:-4], '', IMPRESO, fecha, fecha, detalle))
+        with self._lock:
+            with self._conexion:
+                self._conexion.execute("BEGIN")
+                self._conexion.executemany(
+                    "INSERT OR IGNORE INTO comprobantes "
+                    "(numero_completo, idcomprobante, estado, creado, actualizado, detalle) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", filas)
+                self._conexion.execute("INSERT INTO meta (clave, valor) VALUES ('migrado', ?)", (str(time.time()),))
+        logging.info(f"Diario: {len(filas)} comprobantes migrados desde {carpeta}")
@@ -0,0 +1,248 @@
+import time
+import logging
+
+from metricas import metricas
+from rasterizado import TRAMADO_PREDETERMINADO, preparar_imagen, tramar, comandos_raster
+
+# python-escpos, Pillow y pyusb se importan recién cuando se usan: son la
+# mayor parte del tiempo de arranque y el servicio puede ir pidiendo el
+# listado mientras tanto (ver precargar_modulos).
+
+# Tamaño de cada escritura bulk al enviar un comprobante compilado
+TAMANO_BLOQUE_USB = 16384
+
+# Límite de cada escritura USB, en milisegundos. Con 0 (lo que usa
+# python-escpos por defecto) pyusb espera para siempre y una impresora
+# trabada deja colgado el hilo de su cola. Alcanza de sobra para un bloque
+# aunque la impresora esté imprimiendo una imagen y tenga el buffer lleno.
+TIMEOUT_USB = 15000
+
+# Tamaño del módulo (en puntos) de los códigos QR nativos
+TAMANO_QR = 6
+
+# ESC a: alineación de lo que sigue (códigos nativos). El texto se alinea
+# rellenando con espacios, así que después se vuelve siempre a la izquierda.
+ALINEAR_CENTRO = b'\x1ba\x01'
+ALINEAR_IZQUIERDA = b'\x1ba\x00'
+
+
+# Criterios extra para ubicar el dispositivo cuando hay varias impresoras
+# con el mismo vendor/product: el bus USB o el número de serie
+def criterios_usb(bus=None, serial=None):
+    criterios = {}
+    if bus is not None:
+        criterios['bus'] = bus
+    if serial:
+        criterios['custom_match'] = lambda dispositivo: numero_de_serie(dispositivo) == serial
+    return criterios
+
+
+def numero_de_serie(dispositivo):
+    import usb.util
+    try:
+        return usb.util.get_string(dispositivo, dispositivo.iSerialNumber)
+    except Exception:
+        return None
+
+
+# Clase para gestionar la impresora
+class Impresora:
+    def __init__(self, idvendor, idproduct, ancho_impresora, perfil=None, bus=None, serial=None, tramado=None):
+        from escpos.printer import Usb
+        try:
+            self.printer = Usb(idvendor, idproduct, usb_args=criterios_usb(bus, serial), timeout=TIMEOUT_USB,
+                               profile=perfil)
+        except Exception as e:
+            raise RuntimeError(f"Error al inicializar la impresora: {e}")
+        self.ancho_impresora = ancho_impresora
+        self.perfil = perfil
+        self.tramado = tramado or TRAMADO_PREDETERMINADO
+
+    def imprimir_texto(self, texto, opciones):
+        with metricas.medir('texto'):
+            try:
+                if opciones.get("align") == u'right':
+                    texto = texto.rjust(self.ancho_impresora)
+                elif opciones.get("align") == u'center':
+                    texto = texto.center(self.ancho_impresora)
+                self.printer.text(texto)
+            except Exception as e:
+                raise RuntimeError(f"Error al imprimir texto: {e}")
+
+    def imprimir_imagen(self, imagen):
+        with metricas.medir('imagen'):
+            try:
+                self.enviar(self.rasterizar_imagen(imagen))
+            except Exception as e:
+                raise RuntimeError(f"Error al imprimir imagen: {e}")
+        
+    # QR con el comando nativo de la impresora (GS ( k). Si el perfil no lo
+    # soporta, python-escpos lo genera como imagen raster (centrada por él).
+    # python-escpos no centra el QR nativo (center=True da error): se centra
+    # con ESC a.
+    def imprimir_qr(self, contenido, tamano=TAMANO_QR):
+        try:
+            if self.printer.profile.supports('qrCode'):
+                self.printer._raw(ALINEAR_CENTRO)
+                self.printer.qr(contenido, size=tamano, native=True, center=False)
+                self.printer._raw(ALINEAR_IZQUIERDA)
+            else:
+                self.printer.qr(contenido, size=tamano, native=False, center=True)
+        except Exception as e:
+            raise RuntimeError(f"Error al imprimir QR: {e}")
+
+    # Código de barras nativo (GS k); por software si el perfil no lo soporta.
+    # El nativo centrado deja la impresora en ESC a 1: se vuelve a la izquierda.
+    def imprimir_codigo_barras(self, tipo, datos):
+        try:
+            nativo = self.printer.profile.supports('barcodeB') or self.printer.profile.supports('barcodeA')
+            self.printer.barcode(datos, tipo.upper(), force_software=not nativo)
+            self.printer._raw(ALINEAR_IZQUIERDA)
+        except Exception as e:
+            raise RuntimeError(f"Error al imprimir código de barras: {e}")
+
+    # Devuelve los bytes ESC/POS (GS v 0) de la imagen ya reescalada, sin imprimirla
+    def rasterizar_imagen(self, imagen):
+        with metricas.medir('raster'):
+            try:
+                return comandos_raster(*tramar(self.reescalar_imagen(imagen), self.tramado))
+            except Exception as e:
+                raise RuntimeError(f"Error al rasterizar imagen: {e}")
+
+    # Escala de grises al ancho de la impresora (ver rasterizado.py)
+    def reescalar_imagen(self, imagen):
+        with metricas.medir('reescalado'):
+            try:
+                return preparar_imagen(imagen, self.ancho_impresora)
+            except Exception as e:
+                raise RuntimeError(f"Error al reescalar imagen: {e}")
+
+    def cortar(self):
+        with metricas.medir('corte'):
+            try:
+                self.printer.cut()
+            except Exception as e:
+                raise RuntimeError(f"Error al cortar el papel: {e}")
+
+    # Manda un comprobante ya compilado en pocas escrituras grandes
+    def enviar(self, datos, tamano_bloque=TAMANO_BLOQUE_USB):
+        with metricas.medir('envio_usb') as medicion:
+            medicion.bytes = len(datos)
+            try:
+                for inicio in range(0, len(datos), tamano_bloque):
+                    self.printer._raw(datos[inicio:inicio + tamano_bloque])
+            except Exception as e:
+                raise RuntimeError(f"Error al enviar el comprobante: {e}")
+
+    def cerrar(self):
+        try:
+            self.printer.close()
+        except Exception as e:
+            raise RuntimeError(f"Error al cerrar la impresora: {e}")
+
+
+# Impresora en memoria: acumula los comandos ESC/POS en lugar de mandarlos por
+# USB. Se usa para compilar un comprobante entero en un único buffer.
+class ImpresoraVirtual(Impresora):
+    def __init__(self, ancho_impresora, perfil=None, tramado=None):
+        from escpos.printer import Dummy
+        self.printer = Dummy(profile=perfil)
+        self.ancho_impresora = ancho_impresora
+        self.perfil = perfil
+        self.tramado = tramado or TRAMADO_PREDETERMINADO
+
+    def obtener_bytes(self):
+        return self.printer.output
+
+    # Agrega bytes ya armados (imágenes de la cache) al buffer: no cuenta como envío USB
+    def enviar(self, datos, tamano_bloque=None):
+        self.printer._raw(datos)
+
+    def cerrar(self):
+        self.printer.clear()
+
+
+# Mantiene una única conexión USB abierta entre comprobantes.
+# Si la impresora falla se descarta la conexión y se vuelve a abrir, con
+# espera creciente, la próxima vez que se la pida.
+class SesionImpresora:
+    def __init__(self, idvendor, idproduct, ancho_impresora, perfil=None, reintentos=3, al_cambiar_estado=None,
+                 bus=None, serial=None):
+        self.idvendor = idvendor
+        self.idproduct = idproduct
+        self.ancho_impresora = ancho_impresora
+        self.perfil = perfil
+        self.bus = bus
+        self.serial = serial
+        self.reintentos = reintentos
+        self.al_cambiar_estado = al_cambiar_estado
+        self.impresora = None
+        self.conectada = None
+
+    def obtener(self):
+        if self.impresora is not None:
+            return self.impresora
+        intento = 0
+        while True:
+            try:
+                # Algunas versiones de python-escpos abren el USB recién al escribir
+                if not self.presente():
+                    raise RuntimeError("Error al inicializar la impresora: device not found")
+                self.impresora = Impresora(self.idvendor, self.idproduct, self.ancho_impresora, self.perfil,
+                                           self.bus, self.serial)
+                self._cambiar_estado(True, "Impresora conectada.")
+                return self.impresora
+            except RuntimeError as e:
+                intento += 1
+                if intento >= self.reintentos:
+                    self._cambiar_estado(False, str(e))
+                    raise
+                time.sleep(min(0.5 * 2 ** intento, 4))
+
+    # Consulta barata al bus USB, sin abrir ni reclamar el dispositivo
+    def presente(self):
+        import usb.core
+        try:
+            criterios = criterios_usb(self.bus, self.serial)
+            return usb.core.find(idVendor=self.idvendor, idProduct=self.idproduct, **criterios) is not None
+        except Exception as e:
+            # Sin acceso al bus no se puede saber: se deja que lo intente conectar
+            logging.error(f"No se pudo consultar el bus USB: {e}")
+            return True
+
+    # Se llama cuando una operación falló: la próxima vez se reconecta
+    def invalidar(self, motivo=''):
+        self._liberar()
+        self._cambiar_estado(False, f"Conexión con la impresora perdida. {motivo}".strip())
+
+    def cerrar(self):
+        self._liberar()
+        self._cambiar_estado(False, "Impresora desconectada.")
+
+    def _liberar(self):
+        if self.impresora is None:
+            return
+        try:
+            self.impresora.cerrar()
+        except RuntimeError:
+            pass
+        self.impresora = None
+
+    def _cambiar_estado(self, conectada, mensaje):
+        if conectada == self.conectada:
+            return
+        self.conectada = conectada
+        logging.info(mensaje)
+        if self.al_cambiar_estado is not None:
+            self.al_cambiar_estado(conectada, mensaje)
+
+
+# Importa de antemano los módulos pesados. El servicio la llama en un hilo
+# aparte al arrancar, así la importación se superpone con la primera consulta.
+def precargar_modulos():
+    try:
+        import usb.core
+        from PIL import Image
+        from escpos.printer import Usb, Dummy
+    except ImportError as e:
+        logging.error(f"No se pudieron cargar los módulos de impresión: {e}")
@@ -0,0 +1,195 @@
+import json
+import time
+import queue
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites (en segundos) de los histogramas de duración
+LIMITES_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Cada cuánto se vuelca la traza al archivo
+INTERVALO_TRAZA = 1
+
+
+# Histograma acumulativo al estilo Prometheus, sin dependencias
+class Histograma:
+    __slots__ = ('cuentas', 'suma', 'cantidad')
+
+    def __init__(self):
+        self.cuentas = [0] * (len(LIMITES_SEGUNDOS) + 1)
+        self.suma = 0.0
+        self.cantidad = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect_left(LIMITES_SEGUNDOS, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+
+
+# Mide un bloque `with` y lo registra al salir
+class Medicion:
+    __slots__ = ('metricas', 'etapa', 'inicio', 'bytes')
+
+    def __init__(self, metricas, etapa):
+        self.metricas = metricas
+        self.etapa = etapa
+        self.bytes = None
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.metricas.registrar(self.etapa, time.perf_counter() - self.inicio, self.bytes, error=tipo is not None)
+        return False
+
+
+# Tiempos por etapa del camino de un comprobante: listado, detalle, armado
+# (texto, imagen, reescalado, corte) y envío por USB, más los bytes enviados.
+# Se acumulan en histogramas que se exponen en formato Prometheus por HTTP
+# (solo en 127.0.0.1) y, si se configura, cada medición va además a una traza
+# JSONL con el comprobante al que corresponde. Registrar es un perf_counter,
+# un lock y un bisect; la traza se escribe desde su propio hilo.
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._bytes = {}
+        self._errores = {}
+        self._contexto = threading.local()
+        self._traza = None
+        self._hilo_traza = None
+        self._servidor = None
+
+    def medir(self, etapa):
+        return Medicion(self, etapa)
+
+    def registrar(self, etapa, segundos, bytes_enviados=None, error=False):
+        with self._lock:
+            histograma = self._histogramas.get(etapa)
+            if histograma is None:
+                histograma = self._histogramas[etapa] = Histograma()
+            histograma.observar(segundos)
+            if bytes_enviados:
+                self._bytes[etapa] = self._bytes.get(etapa, 0) + bytes_enviados
+            if error:
+                self._errores[etapa] = self._errores.get(etapa, 0) + 1
+        if self._traza is not None:
+            registro = {'t': time.time(), 'etapa': etapa, 'ms': round(segundos * 1000, 3)}
+            comprobante = self.comprobante()
+            if comprobante is not None:
+                registro['comprobante'] = comprobante
+            if bytes_enviados:
+                registro['bytes'] = bytes_enviados
+            if error:
+                registro['error'] = True
+            self._traza.put(registro)
+
+    # Lo que se mida en este hilo hasta el próximo cambio queda asociado al comprobante
+    def comprobante_actual(self, numero_completo):
+        self._contexto.comprobante = numero_completo
+
+    def comprobante(self):
+        return getattr(self._contexto, 'comprobante', None)
+
+    def iniciar_servidor(self, puerto):
+        if not puerto or self._servidor is not None:
+            return
+        try:
+            self._servidor = ThreadingHTTPServer(('127.0.0.1', puerto), ManejadorMetricas)
+        except OSError as e:
+            logging.error(f"No se pudo abrir el puerto de métricas {puerto}: {e}")
+            return
+        self._servidor.metricas = self
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, name="metricas-http", daemon=True).start()
+        logging.info(f"Métricas en http://127.0.0.1:{puerto}/metrics")
+
+    def abrir_traza(self, ruta):
+        if not ruta or self._hilo_traza is not None:
+            return
+        self._traza = queue.SimpleQueue()
+        self._hilo_traza = threading.Thread(target=self._escribir_traza, args=(ruta,), name="metricas-traza",
+                                            daemon=True)
+        self._hilo_traza.start()
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+        if self._hilo_traza is not None:
+            self._traza.put(None)
+            self._hilo_traza.join(INTERVALO_TRAZA * 2)
+            self._hilo_traza = None
+            self._traza = None
+
+    def _escribir_traza(self, ruta):
+        cola = self._traza
+        try:
+            with open(ruta, 'a', encoding='utf-8') as archivo:
+                while True:
+                    registro = cola.get()
+                    if registro is None:
+                        return
+                    archivo.write(json.dumps(registro) + '\n')
+                    # Se agrupan las escrituras pendientes antes de volcar
+                    while not cola.empty():
+                        registro = cola.get()
+                        if registro is None:
+                            return
+                        archivo.write(json.dumps(registro) + '\n')
+                    archivo.flush()
+        except OSError as e:
+            logging.error(f"No se pudo escribir la traza de métricas {ruta}: {e}")
+            self._traza = None
+
+    # Texto en el formato de exposición de Prometheus
+    def exponer(self):
+        with self._lock:
+            histogramas = {etapa: (list(h.cuentas), h.suma, h.cantidad) for etapa, h in self._histogramas.items()}
+            bytes_enviados = dict(self._bytes)
+            errores = dict(self._errores)
+
+        lineas = ["# HELP ticketprint_etapa_segundos Duración de cada etapa del comprobante.",
+                  "# TYPE ticketprint_etapa_segundos histogram"]
+        for etapa, (cuentas, suma, cantidad) in sorted(histogramas.items()):
+            acumulado = 0
+            for limite, cuenta in zip(LIMITES_SEGUNDOS, cuentas):
+                acumulado += cuenta
+                lineas.append(f'ticketprint_etapa_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+            lineas.append(f'ticketprint_etapa_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {cantidad}')
+            lineas.append(f'ticketprint_etapa_segundos_sum{{etapa="{etapa}"}} {suma}')
+            lineas.append(f'ticketprint_etapa_segundos_count{{etapa="{etapa}"}} {cantidad}')
+        lineas += ["# HELP ticketprint_bytes_total Bytes enviados o recibidos en cada etapa.",
+                   "# TYPE ticketprint_bytes_total counter"]
+        for etapa, total in sorted(bytes_enviados.items()):
+            lineas.append(f'ticketprint_bytes_total{{etapa="{etapa}"}} {total}')
+        lineas += ["# HELP ticketprint_errores_total Etapas que terminaron con error.",
+                   "# TYPE ticketprint_errores_total counter"]
+        for etapa, total in sorted(errores.items()):
+            lineas.append(f'ticketprint_errores_total{{etapa="{etapa}"}} {total}')
+        return '\n'.join(lineas) + '\n'
+
+
+class ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        cuerpo = self.server.metricas.exponer().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+# Única instancia del proceso: la usan el procesador, las impresoras y las colas
+metricas = Metricas()
@@ -0,0 +1,888 @@
+import os
+import time
+import queue
+import logging
+import threading
+import configparser
+import multiprocessing
+from functools import partial
+from collections import deque
+from itertools import islice
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from impresora import SesionImpresora
+from armado import ArmadorComprobantes, iniciar_proceso_armado, armar_en_proceso
+from transporte import PARAMETRO_CURSOR, crear_escucha
+from diario import DiarioImpresion, FALLIDO
+from cola_impresion import ColaImpresion
+from retencion import Retencion
+from metricas import metricas
+from reintentos import PlanificadorReintentos, ESPERA_REINTENTO_MAXIMA
+from rasterizado import normalizar_tramado
+from detalle import DetalleComprobante, LineaInvalida, TAMANO_TROZO, leer_respuesta, separar_lineas
+from configuracion import VigilanteConfiguracion
+
+# Nombre de la impresora de la sección [Impresora]; las demás son [Impresora <nombre>]
+IMPRESORA_PRINCIPAL = 'principal'
+
+# Carpeta donde se guardaban los comprobantes antes del diario; se migra al
+# arrancar y después Retencion la va vaciando
+CARPETA_GUARDADO = 'comprobantes_guardados'
+
+# Con avisos del servidor activos, igual se consulta cada tanto por si se pierde alguno
+INTERVALO_CON_AVISOS = 30
+
+# En la respuesta de app-get-comprobante.php?ids=... cada comprobante empieza
+# con una línea "#comprobante#<idcomprobante>" seguida de sus líneas.
+MARCA_COMPROBANTE = b'#comprobante#'
+# Si el servidor no entiende ?ids=, se vuelve a probar después de este tiempo
+REINTENTO_LOTES = 3600
+# Respuestas HTTP al pedido en lote que quieren decir "no lo soporto" (404,
+# 400, 501...), no que el servidor esté caído. 408 y 429 son pasajeras.
+PASAJERAS_4XX = (408, 429)
+
+# Datos de [Impresora] que obligan a reabrir la conexión si cambian (el
+# tramado no: se usa recién al armar el comprobante)
+CLAVES_CONEXION = ('idvendor', 'idproduct', 'ancho', 'perfil', 'bus', 'serial')
+# Cuánto se espera a que una impresora termine el comprobante en curso antes de reabrirla
+ESPERA_CIERRE_IMPRESORA = 30
+
+# Disyuntores de los endpoints del servidor (ver reintentos.py)
+ENDPOINT_LISTADO = 'servidor (listado)'
+ENDPOINT_DETALLES = 'servidor (detalles)'
+
+
+# Núcleo de descarga e impresión de comprobantes.
+# Corre en un hilo propio, separado del loop de Tk, y solo se comunica con la
+# interfaz a través de la cola `eventos`, donde deja tuplas (tipo, mensaje).
+# Este hilo descarga y arma los comprobantes y los deja en la cola de
+# impresión persistente; ColaImpresion los manda a la impresora cuando está.
+# Tipos: 'neutro', 'exito', 'error', 'impreso' (mensaje = numero_completo),
+# 'impresora' (mensaje = (nombre, 'conectada' / 'desconectada')),
+# 'reintentos' (mensaje = resumen de lo que está fallando, '' si nada) e
+# 'impresos' (mensaje = (desde, total, filas), la página pedida con pedir_impresos).
+class ProcesadorComprobantes:
+    # `reinicio_automatico`: sin interfaz no hay quien toque 'Reiniciar', así
+    # que ante un error inesperado se espera frecuencia_error y se sigue.
+    def __init__(self, eventos=None, reinicio_automatico=False):
+        self.eventos = eventos if eventos is not None else queue.Queue()
+        self.reinicio_automatico = reinicio_automatico
+        self.error_detectado = False
+        self._hilo = None
+        self._detener = threading.Event()
+        self._despertar = threading.Event()
+        self.frecuencia_error = 60
+        # Cambios de config.ini con el programa andando: se validan en el hilo
+        # del vigilante y se aplican acá, entre un ciclo y otro
+        self.ruta_configuracion = os.path.join(os.getcwd(), 'config.ini')
+        self.vigilante = VigilanteConfiguracion(self.ruta_configuracion, leer_configuracion,
+                                                self.configuracion_nueva, al_fallar=self.mostrar_error_configuracion)
+        self._configuracion_nueva = None
+        self.cargar_configuracion()
+        # Descargas de detalle en paralelo, adelantadas al armado
+        self._descargas = ThreadPoolExecutor(max_workers=self.descargas_anticipadas, thread_name_prefix="descarga-detalle")
+        # Páginas de la lista de impresos que pide la interfaz, fuera del hilo de Tk
+        self._consultas = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consulta-impresos")
+        # Reintentos sin bloquear y disyuntores por endpoint
+        self.reintentos = PlanificadorReintentos()
+        self._resumen_reintentos = None
+        # Armado de los comprobantes: en este hilo, o en un pool de procesos
+        # si `procesos_armado` > 0 (comprobantes con muchas imágenes en equipos
+        # con varios núcleos)
+        self.armador = ArmadorComprobantes(self.url_base, self.reintentos)
+        self._armado = None
+        if self.procesos_armado > 0:
+            self._crear_pool_armado()
+        # Registro de lo impreso (reemplaza a un .txt por comprobante) y cola de impresión
+        self.diario = DiarioImpresion(carpeta_anterior=CARPETA_GUARDADO)
+        # Limpieza y compactado del diario en segundo plano
+        self.retencion = Retencion(self.diario, self.dias_a_eliminar, self.dias_compactar,
+                                   carpeta_anterior=CARPETA_GUARDADO)
+        # Una conexión USB por impresora, abierta entre comprobantes, y su cola
+        self.sesiones_impresora = {}
+        self.colas_impresion = {}
+        for nombre, impresora in self.impresoras.items():
+            self.abrir_impresora(nombre, impresora)
+        # Sesión HTTP reutilizable para el listado y los detalles
+        self.session = requests.Session()
+        self.montar_adaptador()
+        # Último idcomprobante ya resuelto (todo lo anterior está impreso o en cola)
+        self.cursor = None
+        self._proximo_listado_completo = 0
+        # Hasta cuándo se piden los detalles de a uno porque el servidor no soporta lotes
+        self._lotes_no_soportados_hasta = 0
+        # (url, ETag, Last-Modified) de la última respuesta del listado
+        self._validadores_listado = (None, None, None)
+        # Avisos del servidor (long-polling o SSE) según `transporte` en config.ini
+        self.escucha = crear_escucha(self.transporte, self.url_base, self.pto_vta, self.avisar_novedades,
+                                     obtener_cursor=lambda: self.cursor,
+                                     al_cambiar_estado=self._estado_escucha)
+
+    # Cargar la configuración desde el archivo config.ini
+    def cargar_configuracion(self):
+        self.configuracion = leer_configuracion(self.ruta_configuracion)
+        for clave, valor in self.configuracion.items():
+            setattr(self, clave, valor)
+
+    # Llamado desde el hilo del vigilante con un config.ini ya validado
+    def configuracion_nueva(self, configuracion):
+        self._configuracion_nueva = configuracion
+        self._despertar.set()
+
+    def mostrar_error_configuracion(self, mensaje):
+        self.mostrar_mensaje(mensaje, 'error')
+
+    # Aplica de una vez, desde el hilo del procesador, lo que cambió en
+    # config.ini. Solo se toca lo afectado: el cursor y los avisos si cambió
+    # el servidor o los puntos de venta, la conexión de la impresora que
+    # cambió, los pools si cambió su tamaño. La frecuencia nueva vale desde
+    # la próxima espera. Nada de lo que está en el diario se vuelve a imprimir.
+    def aplicar_configuracion_pendiente(self):
+        nueva, self._configuracion_nueva = self._configuracion_nueva, None
+        if nueva is None:
+            return
+        anterior = self.configuracion
+        cambios = {clave for clave, valor in nueva.items() if anterior.get(clave) != valor}
+        if not cambios:
+            return
+        self.configuracion = nueva
+        for clave in cambios:
+            setattr(self, clave, nueva[clave])
+
+        if cambios & {'url_base', 'pto_vta'}:
+            # Otro servidor u otros puntos de venta: lo que se sabía del listado ya no vale
+            self.cursor = None
+            self._proximo_listado_completo = 0
+            self._lotes_no_soportados_hasta = 0
+            self._validadores_listado = (None, None, None)
+            self.armador.url_base = self.url_base
+        if 'descargas_anticipadas' in cambios:
+            descargas = self._descargas
+            self._descargas = ThreadPoolExecutor(max_workers=self.descargas_anticipadas,
+                                                 thread_name_prefix="descarga-detalle")
+            descargas.shutdown(wait=False)
+            self.montar_adaptador()
+        if cambios & {'procesos_armado', 'url_base'}:
+            if self.procesos_armado > 0:
+                self._crear_pool_armado()
+            elif self._armado is not None:
+                self._armado.shutdown(wait=False, cancel_futures=True)
+                self._armado = None
+        if cambios & {'dias_a_eliminar', 'dias_compactar'}:
+            self.retencion.dias = self.dias_a_eliminar
+            self.retencion.dias_compactar = self.dias_compactar
+        if cambios & {'url_base', 'pto_vta', 'transporte'}:
+            self.reiniciar_escucha()
+        if cambios & {'puerto_metricas', 'traza_metricas'}:
+            metricas.detener()
+            metricas.iniciar_servidor(self.puerto_metricas)
+            metricas.abrir_traza(self.traza_metricas)
+        if 'impresoras' in cambios:
+            self.actualizar_impresoras(anterior['impresoras'], nueva['impresoras'])
+
+        mensaje = f"Configuración actualizada: {', '.join(sorted(cambios))}."
+        logging.info(mensaje)
+        self.mostrar_mensaje(mensaje, 'exito')
+
+    # Sesión y cola de una impresora; la cola arranca si el procesador ya está corriendo
+    def abrir_impresora(self, nombre, impresora):
+        sesion = SesionImpresora(impresora['idvendor'], impresora['idproduct'], impresora['ancho'], impresora['perfil'],
+                                 al_cambiar_estado=partial(self._estado_impresora, nombre),
+                                 bus=impresora['bus'], serial=impresora['serial'])
+        self.sesiones_impresora[nombre] = sesion
+        self.colas_impresion[nombre] = ColaImpresion(sesion, self.diario, self.eventos, nombre)
+        if self._hilo is not None and self._hilo.is_alive():
+            self.colas_impresion[nombre].iniciar()
+
+    # Espera a que termine el comprobante que se está mandando y suelta el USB
+    def cerrar_impresora(self, nombre):
+        self.colas_impresion.pop(nombre).detener(ESPERA_CIERRE_IMPRESORA)
+        self.sesiones_impresora.pop(nombre).cerrar()
+
+    # Reabre solo las impresoras cuya conexión cambió; lo que tenían en
+    # cola sigue en el diario y lo toma la cola nueva
+    def actualizar_impresoras(self, anteriores, nuevas):
+        for nombre in anteriores.keys() - nuevas.keys():
+            self.cerrar_impresora(nombre)
+            en_cola = self.diario.en_cola(nombre)
+            if en_cola:
+                self.mostrar_mensaje(f"Se quitó la impresora {nombre} con {en_cola} comprobantes en cola; "
+                                     f"se imprimen si se vuelve a agregar.", 'error')
+        for nombre, impresora in nuevas.items():
+            previa = anteriores.get(nombre)
+            if previa is not None and all(previa[clave] == impresora[clave] for clave in CLAVES_CONEXION):
+                continue
+            if nombre in self.colas_impresion:
+                self.cerrar_impresora(nombre)
+            self.abrir_impresora(nombre, impresora)
+            logging.info(f"Impresora {nombre}: conexión reabierta con la configuración nueva.")
+
+    def reiniciar_escucha(self):
+        if self.escucha is not None:
+            self.escucha.detener()
+        self.escucha = crear_escucha(self.transporte, self.url_base, self.pto_vta, self.avisar_novedades,
+                                     obtener_cursor=lambda: self.cursor,
+                                     al_cambiar_estado=self._estado_escucha)
+        if self.escucha is not None and self._hilo is not None and self._hilo.is_alive():
+            self.escucha.iniciar()
+
+    def montar_adaptador(self):
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.descargas_anticipadas + 1)
+        self.session.mount('http://', adaptador)
+        self.session.mount('https://', adaptador)
+
+    # Arranca el hilo de trabajo. Se puede llamar desde el hilo de Tk.
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        metricas.iniciar_servidor(self.puerto_metricas)
+        metricas.abrir_traza(self.traza_metricas)
+        # Antes de que la cola tome nada, se resuelve lo que quedó a mitad de envío
+        self.recuperar_interrumpidos()
+        for cola in self.colas_impresion.values():
+            cola.iniciar()
+        self.retencion.iniciar()
+        self.vigilante.iniciar()
+        self._hilo = threading.Thread(target=self.ciclo_principal, name="procesador-comprobantes", daemon=True)
+        self._hilo.start()
+        if self.escucha is not None:
+            self.escucha.iniciar()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        self.vigilante.detener(timeout)
+        if self.escucha is not None:
+            self.escucha.detener()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+        self._descargas.shutdown(wait=False, cancel_futures=True)
+        self._consultas.shutdown(wait=False, cancel_futures=True)
+        if self._armado is not None:
+            self._armado.shutdown(wait=False, cancel_futures=True)
+        for cola in self.colas_impresion.values():
+            cola.detener(timeout)
+        self.retencion.detener(timeout)
+        for sesion in self.sesiones_impresora.values():
+            sesion.cerrar()
+        metricas.detener()
+
+    # Despierta al hilo sin esperar a que venza la espera por error
+    def reiniciar_proceso(self):
+        self.reintentos.reiniciar()
+        self._despertar.set()
+        for cola in self.colas_impresion.values():
+            cola.avisar()
+
+    # Llamado desde el hilo de la escucha: se consulta el listado ya mismo
+    def avisar_novedades(self):
+        self._despertar.set()
+
+    # Mientras lleguen avisos del servidor no hace falta consultar tan seguido
+    # Si hay un comprobante con reintento agendado antes, se despierta para ese momento.
+    def intervalo_espera(self):
+        if self.escucha is not None and self.escucha.activo:
+            intervalo = max(self.frecuencia_actualizacion, INTERVALO_CON_AVISOS)
+        else:
+            intervalo = self.frecuencia_actualizacion
+        proximo_reintento = self.reintentos.proximo()
+        if proximo_reintento is not None:
+            intervalo = min(intervalo, proximo_reintento)
+        return intervalo
+
+    def _esperar(self, segundos=None):
+        self._despertar.wait(segundos)
+        self._despertar.clear()
+
+    def ciclo_principal(self):
+        self.mostrar_mensaje('Iniciando proceso de comprobantes.', 'neutro')
+        while not self._detener.is_set():
+            try:
+                self.aplicar_configuracion_pendiente()
+                self.procesar_ciclo()
+            except Exception as e:
+                mensaje_error = f"Ocurrió un error: {str(e)}"
+                logging.error(mensaje_error)
+                self.mostrar_error(mensaje_error)
+                if self.reinicio_automatico:
+                    self.mostrar_mensaje(f"Se reintenta en {self.frecuencia_error} segundos.")
+                    self._esperar(self.frecuencia_error)
+                    self.reiniciar_error()
+                    continue
+                # Detenemos el ciclo hasta que se pida reiniciar
+                self.mostrar_mensaje("Proceso detenido debido a un error.\nHaga clic en 'Reiniciar' para continuar.")
+                self._esperar()
+                self.reiniciar_error()
+                continue
+
+            self.informar_reintentos()
+            if self.error_detectado:
+                self._esperar(self.frecuencia_error)
+                self.reiniciar_error()
+            else:
+                self._esperar(self.intervalo_espera())
+
+    def url_listado(self, cursor=None):
+        url = f"{self.url_base}app-get-comprobantes.php?ptoVta={self.pto_vta}"
+        if cursor is not None:
+            url += f"&{PARAMETRO_CURSOR}={cursor}"
+        return url
+
+    # Normalmente solo se piden los comprobantes posteriores al cursor. Cada
+    # `intervalo_listado_completo` segundos (y al arrancar) se pide el listado
+    # completo y se controla contra lo guardado, por si el servidor ignora el
+    # cursor o aparece un comprobante con un id menor.
+    def procesar_ciclo(self):
+        metricas.comprobante_actual(None)
+        completo = self.cursor is None or time.monotonic() >= self._proximo_listado_completo
+        url = self.url_listado(None if completo else self.cursor)
+        comprobantes = self.obtener_comprobantes(url)
+        if comprobantes is None:
+            return
+        if completo:
+            self._proximo_listado_completo = time.monotonic() + self.intervalo_listado_completo
+        if not comprobantes:
+            logging.info("No hay comprobantes nuevos.")
+            return
+
+        # En modo incremental lo que está por debajo del cursor ya se imprimió,
+        # así que ni siquiera se consulta el diario
+        if not completo:
+            comprobantes_nuevos = [c for c in comprobantes if id_numerico(c) is None or id_numerico(c) > self.cursor]
+        else:
+            comprobantes_nuevos = comprobantes
+        pendientes = self.diario.nuevos(comprobantes_nuevos)
+        completados = self.procesar_pendientes(pendientes)
+
+        # El cursor solo avanza si no quedó nada sin encolar en este ciclo
+        if completados and not self.error_detectado:
+            ids = [i for i in map(id_numerico, comprobantes) if i is not None]
+            if ids:
+                self.cursor = max(ids) if self.cursor is None else max(self.cursor, max(ids))
+
+    # Comprobantes que quedaron a mitad de envío por un corte del programa
+    def recuperar_interrumpidos(self):
+        for numero_completo in self.diario.recuperar(self.reimprimir_interrumpidos):
+            if self.reimprimir_interrumpidos:
+                mensaje = f"El comprobante {numero_completo} se cortó al imprimirse: se vuelve a imprimir."
+            else:
+                mensaje = f"El comprobante {numero_completo} se cortó al imprimirse: revisar y reimprimir si hace falta."
+            logging.warning(mensaje)
+            self.mostrar_mensaje(mensaje, 'error')
+
+    # Avisa a la interfaz cuando cambia lo que está esperando reintento
+    def informar_reintentos(self):
+        resumen = self.reintentos.resumen()
+        if resumen != self._resumen_reintentos:
+            self._resumen_reintentos = resumen
+            self.eventos.put(('reintentos', resumen or ''))
+
+    def reiniciar_error(self):
+        if self._detener.is_set():
+            return
+        self.error_detectado = False
+        self.mostrar_mensaje("Proceso reiniciado.", 'exito')
+
+    def url_detalle_comprobante(self, comprobante):
+        return f"{self.url_base}app-get-comprobante.php?id={comprobante.get('idcomprobante', '')}"
+
+    # Ventana deslizante: mientras se arma un comprobante ya se están
+    # descargando los siguientes `descargas_anticipadas` (o el lote siguiente,
+    # si se piden en lote). Con pool de armado, además, se arman varios a la
+    # vez. Se encolan siempre en el orden del listado, que es el orden en que
+    # los imprime ColaImpresion. Devuelve True si se encolaron todos.
+    # Los comprobantes que fallaron antes esperan su turno en el planificador.
+    def procesar_pendientes(self, pendientes):
+        # Con el servidor de detalles caído no se intenta nada hasta la próxima prueba
+        if self.reintentos.disyuntor(ENDPOINT_DETALLES).abierto():
+            return False
+        listos = [c for c in pendientes if self.reintentos.listo(c.get('numero_completo', ''))]
+        demorados = len(listos) < len(pendientes)
+        pendientes = listos
+        restantes = iter(pendientes)
+        en_curso = deque()
+        armados = deque()
+        en_lote = len(pendientes) > 1 and self.usar_lotes()
+        objetivo = self.tamano_lote if en_lote else self.descargas_anticipadas
+        armados_en_vuelo = 2 * self.procesos_armado if self._armado is not None else 1
+
+        def adelantar_descarga():
+            if en_lote:
+                lote = list(islice(restantes, self.tamano_lote))
+                if not lote:
+                    return False
+                descargas = [Future() for _ in lote]
+                tarea = self._descargas.submit(self.obtener_detalles_en_lote, lote, descargas)
+                # Si detener() cancela la tarea antes de que corra, nadie más
+                # completaría estos Future
+                tarea.add_done_callback(partial(cancelar_si_cancelada, descargas))
+                en_curso.extend(zip(lote, descargas))
+                return True
+            comprobante = next(restantes, None)
+            if comprobante is None:
+                return False
+            url = self.url_detalle_comprobante(comprobante)
+            en_curso.append((comprobante, self._descargas.submit(self.obtener_detalle_comprobante, url)))
+            return True
+
+        def completar_ventana():
+            while len(en_curso) < objetivo and adelantar_descarga():
+                pass
+
+        completar_ventana()
+        completados = not demorados
+        while en_curso or armados:
+            # Lo ya descargado pasa a armarse, sin adelantarse al orden
+            while en_curso and len(armados) < armados_en_vuelo:
+                comprobante, descarga = en_curso.popleft()
+                completar_ventana()
+                try:
+                    detalle_comprobante = descarga.result()
+                except CancelledError:
+                    # detener() canceló las descargas que faltaban
+                    break
+                armados.append((comprobante, detalle_comprobante, self.armar_comprobante(comprobante, detalle_comprobante)))
+            if not armados:
+                completados = False
+                break
+            comprobante, detalle_comprobante, armado = armados.popleft()
+            if not self.procesar_comprobante(comprobante, detalle_comprobante, armado):
+                completados = False
+            if self.error_detectado or self._detener.is_set():
+                completados = False
+                break
+
+        # Lo que quedó en la ventana se vuelve a pedir en el próximo ciclo
+        for _, descarga in en_curso:
+            descarga.cancel()
+        for _, _, armado in armados:
+            if armado is not None:
+                armado.cancel()
+        return completados
+
+    def usar_lotes(self):
+        return self.tamano_lote > 1 and time.monotonic() >= self._lotes_no_soportados_hasta
+
+    # Pide varios detalles en un solo request y va completando cada Future a
+    # medida que llega su comprobante, así la impresión arranca antes de que
+    # termine la respuesta. Lo que no vino en el lote se pide de a uno. Pase
+    # lo que pase, al salir no queda ningún Future sin completar: el
+    # procesador los espera sin límite de tiempo.
+    def obtener_detalles_en_lote(self, lote, descargas):
+        por_id = {}
+        for comprobante, descarga in zip(lote, descargas):
+            if descarga.set_running_or_notify_cancel():
+                por_id[str(comprobante.get('idcomprobante', ''))] = (comprobante, descarga)
+        try:
+            self._obtener_detalles_en_lote(por_id)
+        finally:
+            for _, descarga in por_id.values():
+                if not descarga.done():
+                    descarga.set_result(None)
+
+    def _obtener_detalles_en_lote(self, por_id):
+        if not por_id:
+            return
+
+        disyuntor = self.reintentos.disyuntor(ENDPOINT_DETALLES)
+        if not disyuntor.permitir():
+            for _, descarga in por_id.values():
+                descarga.set_result(None)
+            return
+
+        recibidos = 0
+        try:
+            url = f"{self.url_base}app-get-comprobante.php?ids={','.join(por_id)}"
+            with metricas.medir('detalle_lote'), self.session.get(url, stream=True) as response:
+                if lote_no_soportado(response.status_code):
+                    # El servidor respondió, solo que no entiende ?ids=
+                    disyuntor.exito()
+                    raise ValueError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                # El servidor respondió: aunque no entienda el pedido en lote
+                # (ValueError), la prueba del disyuntor salió bien
+                disyuntor.exito()
+                lineas = separar_lineas(response.iter_content(TAMANO_TROZO))
+                for idcomprobante, detalle_comprobante in leer_documentos(lineas, response.encoding or 'utf-8'):
+                    recibidos += 1
+                    pendiente = por_id.pop(idcomprobante, None)
+                    if pendiente is not None:
+                        pendiente[1].set_result(detalle_comprobante)
+            if recibidos == 0:
+                raise ValueError("respuesta sin comprobantes")
+        except ValueError as e:
+            self._lotes_no_soportados_hasta = time.monotonic() + REINTENTO_LOTES
+            logging.info(f"El servidor no soporta pedir detalles en lote ({e}). Se piden de a uno.")
+        except requests.exceptions.RequestException as e:
+            disyuntor.fallo()
+            logging.error(f"Error al obtener detalles en lote: {e}. Se piden de a uno.")
+        except Exception as e:
+            # Por ejemplo, una codificación desconocida en la respuesta
+            logging.error(f"Error inesperado al leer detalles en lote: {e}. Se piden de a uno.")
+
+        for comprobante, descarga in por_id.values():
+            try:
+                descarga.set_result(self.obtener_detalle_comprobante(self.url_detalle_comprobante(comprobante)))
+            except Exception as e:
+                logging.error(f"Error al obtener detalle del comprobante: {e}")
+                descarga.set_result(None)
+
+    # Empieza a armar el comprobante (en el pool, o acá mismo si no hay) y
+    # devuelve un Future con (bytes, segundos). None si no hace falta armarlo.
+    def armar_comprobante(self, comprobante, detalle_comprobante):
+        if not detalle_comprobante or self.diario.resuelto(comprobante.get('numero_completo', '')):
+            return None
+        destino = self.impresoras[self.impresora_para(comprobante)]
+        armado = Future()
+        try:
+            instrucciones = detalle_comprobante.validas()
+        except LineaInvalida as e:
+            armado.set_exception(e)
+            return armado
+        # Al pool van solo las instrucciones, no el cuerpo que se guarda en el diario
+        if self._armado is not None:
+            try:
+                return self._armado.submit(armar_en_proceso, instrucciones, destino)
+            except BrokenProcessPool:
+                # Se cayó un proceso de armado: se arma un pool nuevo
+                self._crear_pool_armado()
+                return self._armado.submit(armar_en_proceso, instrucciones, destino)
+        metricas.comprobante_actual(comprobante.get('numero_completo', ''))
+        try:
+            armado.set_result(self.armador.armar(instrucciones, destino))
+        except Exception as e:
+            armado.set_exception(e)
+        return armado
+
+    def _crear_pool_armado(self):
+        if self._armado is not None:
+            self._armado.shutdown(wait=False, cancel_futures=True)
+        # spawn: el procesador ya tiene hilos corriendo, no conviene hacer fork
+        self._armado = ProcessPoolExecutor(max_workers=self.procesos_armado,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=iniciar_proceso_armado, initargs=(self.url_base,))
+
+    # Deja en la cola de impresión el comprobante ya descargado y armado (o
+    # lo arma si no viene `armado`). No depende de que la impresora esté conectada.
+    def procesar_comprobante(self, comprobante, detalle_comprobante, armado=None):
+        numero_completo = comprobante.get('numero_completo', '')
+        idcomprobante = comprobante.get('idcomprobante', '')
+        if not detalle_comprobante:
+            self.reintentar(numero_completo, "no se pudo descargar el detalle")
+            return False
+        if armado is None:
+            armado = self.armar_comprobante(comprobante, detalle_comprobante)
+            if armado is None:
+                return True
+        nombre_impresora = self.impresora_para(comprobante)
+        metricas.comprobante_actual(numero_completo)
+        try:
+            datos, segundos = armado.result()
+        except BrokenProcessPool as e:
+            # El comprobante no tiene la culpa: se vuelve a intentar en el próximo ciclo
+            self._crear_pool_armado()
+            mensaje_error = f"Se cayó un proceso de armado con el comprobante {numero_completo}: {e}"
+            logging.error(mensaje_error)
+            # Sin pausa general: los demás comprobantes siguen con el pool nuevo
+            self.mostrar_mensaje(mensaje_error, 'error')
+            return False
+        except Exception as e:
+            # Solo este comprobante queda para reintentar; los demás siguen
+            metricas.registrar('armado', 0, error=True)
+            self.diario.registrar(numero_completo, idcomprobante, FALLIDO, detalle_comprobante.texto())
+            # El cuerpo completo queda en el diario (estado fallido); al registro va solo un resumen
+            logging.error(f"Error al armar el comprobante {numero_completo}: {e}, "
+                          f"comprobante: {detalle_comprobante.resumen()}")
+            self.reintentar(numero_completo, f"error al armarlo: {e}")
+            return False
+        metricas.registrar('armado', segundos, len(datos))
+        self.reintentos.exito(numero_completo)
+        # Cuerpo y bytes quedan en disco antes de imprimir (write-ahead)
+        self.diario.encolar(numero_completo, idcomprobante, detalle_comprobante.texto(), datos, nombre_impresora)
+        self.colas_impresion[nombre_impresora].avisar()
+        return True
+
+    # Agenda otro intento del comprobante sin frenar al resto
+    def reintentar(self, numero_completo, motivo):
+        if self.reintentos.fallo(numero_completo):
+            self.mostrar_mensaje(f"Comprobante {numero_completo}: {motivo}. Se reintenta más tarde.", 'error')
+        else:
+            mensaje_error = (f"Comprobante {numero_completo}: {motivo}. Agotados los reintentos rápidos; "
+                             f"se vuelve a intentar cada {ESPERA_REINTENTO_MAXIMA // 60} minutos.")
+            logging.error(mensaje_error)
+            self.mostrar_mensaje(mensaje_error, 'error')
+
+    # Regla de [Ruteo] que corresponde al comprobante: primero por tipo, después
+    # por punto de venta; si ninguna aplica, la impresora principal
+    def impresora_para(self, comprobante):
+        if self.ruteo:
+            tipo = str(comprobante.get('tipo', '')).strip().lower()
+            if tipo and f"tipo.{tipo}" in self.ruteo:
+                return self.ruteo[f"tipo.{tipo}"]
+            pto_vta = punto_de_venta(comprobante)
+            if pto_vta is not None and f"pto_vta.{pto_vta}" in self.ruteo:
+                return self.ruteo[f"pto_vta.{pto_vta}"]
+        return IMPRESORA_PRINCIPAL
+
+    # Obtiene los comprobantes de la web. Con un 304 devuelve una lista vacía.
+    # Un solo intento: si falla, el próximo ciclo vuelve a probar, y si el
+    # servidor viene fallando su disyuntor evita ir a la red (None).
+    def obtener_comprobantes(self, url_comprobantes):
+        disyuntor = self.reintentos.disyuntor(ENDPOINT_LISTADO)
+        if not disyuntor.permitir():
+            return None
+        encabezados = {}
+        url_anterior, etag, last_modified = self._validadores_listado
+        if url_anterior == url_comprobantes:
+            if etag:
+                encabezados['If-None-Match'] = etag
+            if last_modified:
+                encabezados['If-Modified-Since'] = last_modified
+
+        try:
+            with metricas.medir('listado') as medicion:
+                response = self.session.get(url_comprobantes, headers=encabezados)
+                if response.status_code == 304:
+                    comprobantes = []
+                else:
+                    response.raise_for_status()
+                    medicion.bytes = len(response.content)
+                    comprobantes = response.json()
+                    self._validadores_listado = (url_comprobantes, response.headers.get('ETag'),
+                                                 response.headers.get('Last-Modified'))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            mensaje_error = f"Error al obtener comprobantes: {e}"
+            if disyuntor.fallo():
+                mensaje_error += ". Se vuelve a probar más tarde."
+            logging.error(mensaje_error)
+            self.mostrar_mensaje(mensaje_error, 'error')
+            return None
+        if disyuntor.exito():
+            self.mostrar_mensaje("Conexión con el servidor restablecida.", 'exito')
+        return comprobantes
+
+    # Un solo intento; si falla devuelve None y el comprobante se reintenta después.
+    # La respuesta se interpreta a medida que llega (ver detalle.py).
+    def obtener_detalle_comprobante(self, url_detalle_comprobante):
+        disyuntor = self.reintentos.disyuntor(ENDPOINT_DETALLES)
+        if not disyuntor.permitir():
+            return None
+        try:
+            with metricas.medir('detalle') as medicion, \
+                    self.session.get(url_detalle_comprobante, stream=True) as response:
+                response.raise_for_status()
+                detalle_comprobante = leer_respuesta(response)
+                medicion.bytes = len(detalle_comprobante.cuerpo)
+        except requests.exceptions.RequestException as e:
+            disyuntor.fallo()
+            logging.error(f"Error al obtener detalle del comprobante: {e}")
+            return None
+        disyuntor.exito()
+        return detalle_comprobante
+
+    # Arma el comprobante completo en memoria y devuelve los bytes ESC/POS
+    def compilar_comprobante(self, detalle_comprobante, destino=None):
+        return self.armador.compilar(detalle_comprobante.validas(), destino or self.impresoras[IMPRESORA_PRINCIPAL])
+
+    # Pedido de la interfaz: una página de lo impreso, leída del diario en el
+    # hilo de consultas (compite por el diario con las escrituras, que hacen
+    # fsync). Llega como evento 'impresos'.
+    def pedir_impresos(self, desde, cantidad):
+        try:
+            self._consultas.submit(self._leer_impresos, desde, cantidad)
+        except RuntimeError:
+            # Ya se detuvo el procesador
+            pass
+
+    def _leer_impresos(self, desde, cantidad):
+        try:
+            total = self.diario.cantidad_impresos()
+            desde = max(0, min(desde, total - cantidad))
+            filas = self.diario.impresos(desde, cantidad)
+        except Exception as e:
+            logging.error(f"Error al leer los comprobantes impresos: {e}")
+            total, filas = 0, []
+        self.eventos.put(('impresos', (desde, total, filas)))
+
+    # Los mensajes se encolan; la interfaz los lee desde su propio hilo
+    def mostrar_mensaje(self, mensaje, tipo='neutro'):
+        self.eventos.put((tipo, mensaje))
+
+    def mostrar_error(self, mensaje):
+        self.error_detectado = True
+        self.eventos.put(('error', mensaje))
+
+    def _estado_impresora(self, nombre, conectada, mensaje):
+        self.eventos.put(('impresora', (nombre, 'conectada' if conectada else 'desconectada')))
+
+    def _estado_escucha(self, activo):
+        if activo:
+            self.mostrar_mensaje(f"Recibiendo avisos del servidor ({self.transporte}).", 'neutro')
+        else:
+            self.mostrar_mensaje(f"Sin avisos del servidor: se consulta cada {self.frecuencia_actualizacion} segundos.", 'neutro')
+            # Por si se perdió algo mientras la conexión estaba caída
+            self._despertar.set()
+
+
+def lote_no_soportado(estado):
+    return (400 <= estado < 500 and estado not in PASAJERAS_4XX) or estado == 501
+
+
+# Callback de la tarea de un lote: si se canceló sin llegar a correr, se
+# cancelan también los Future de sus comprobantes
+def cancelar_si_cancelada(descargas, tarea):
+    if tarea.cancelled():
+        for descarga in descargas:
+            descarga.cancel()
+
+
+def id_numerico(comprobante):
+    try:
+        return int(comprobante.get('idcomprobante'))
+    except (TypeError, ValueError):
+        return None
+
+
+# Separa la respuesta de un pedido en lote (líneas en bytes) en
+# (idcomprobante, DetalleComprobante), interpretando cada uno a medida que llega.
+# Si lo primero que llega no es una marca de comprobante, el servidor
+# ignoró ?ids= y respondió otra cosa.
+def leer_documentos(lineas, codificacion='utf-8'):
+    actual = None
+    detalle_comprobante = None
+    for linea in lineas:
+        if linea.startswith(MARCA_COMPROBANTE):
+            if actual is not None:
+                yield actual, detalle_comprobante
+            actual = linea[len(MARCA_COMPROBANTE):].strip().decode(codificacion, 'replace')
+            detalle_comprobante = DetalleComprobante(codificacion)
+        elif actual is not None:
+            detalle_comprobante.agregar(linea)
+        elif linea.strip():
+            raise ValueError("formato de lote desconocido")
+    if actual is not None:
+        yield actual, detalle_comprobante
+
+
+# Lee y valida config.ini. Devuelve un diccionario con los mismos nombres que
+# los atributos del procesador; ante cualquier dato inválido lanza una excepción.
+def leer_configuracion(ruta):
+    config = configparser.ConfigParser()
+    if not config.read(ruta):
+        raise FileNotFoundError(f"No se pudo leer {ruta}")
+    try:
+        return valores_configuracion(config)
+    except KeyError as e:
+        raise ValueError(f"falta {e} en config.ini") from e
+
+
+def valores_configuracion(config):
+    general = config["General"]
+
+    url_base = general["url_base"].strip()
+    if not url_base.startswith(('http://', 'https://')):
+        raise ValueError(f"url_base inválida: '{url_base}'")
+    # Agrega barra al final por las dudas
+    if not url_base.endswith("/"):
+        url_base += "/"
+    pto_vta = general["pto_vta"].strip()
+    if not pto_vta:
+        raise ValueError("pto_vta está vacío")
+    frecuencia_actualizacion = int(general["frecuencia_actualizacion"])
+    if frecuencia_actualizacion < 1:
+        raise ValueError("frecuencia_actualizacion tiene que ser de al menos 1 segundo")
+
+    impresoras = cargar_impresoras(config)
+    return {
+        'url_base': url_base,
+        'pto_vta': pto_vta,
+        'frecuencia_actualizacion': frecuencia_actualizacion,
+        'dias_a_eliminar': int(general["dias_a_eliminar"]),
+        # A partir de cuántos días el cuerpo de lo impreso pasa al archivo comprimido
+        'dias_compactar': int(general.get("dias_compactar", 1)),
+        # Cuántos comprobantes se descargan por adelantado mientras se imprime
+        'descargas_anticipadas': max(1, int(general.get("descargas_anticipadas", 4))),
+        # Cuántos detalles se piden juntos cuando hay varios pendientes (0 = de a uno)
+        'tamano_lote': max(0, int(general.get("tamano_lote", 20))),
+        # Procesos que arman comprobantes en paralelo (0 = en el hilo del procesador)
+        'procesos_armado': max(0, int(general.get("procesos_armado", 0))),
+        # Cada cuántos segundos se pide el listado completo en lugar del incremental
+        'intervalo_listado_completo': int(general.get("intervalo_listado_completo", 300)),
+        # Qué hacer al arrancar con un comprobante que quedó a mitad de envío
+        'reimprimir_interrumpidos': general.get("reimprimir_interrumpidos", "no").strip().lower() in ("si", "sí", "1", "true"),
+        # polling, longpoll o sse
+        'transporte': general.get("transporte", "polling").strip().lower(),
+        # Métricas por etapa en http://127.0.0.1:<puerto>/metrics (0 = apagado) y traza JSONL opcional
+        'puerto_metricas': int(general.get("puerto_metricas", 0) or 0),
+        'traza_metricas': general.get("traza_metricas", "").strip(),
+        # Variables de la conexión a las impresoras y a cuál va cada comprobante
+        'impresoras': impresoras,
+        'ruteo': cargar_ruteo(config, impresoras),
+    }
+
+
+# Lee [Impresora] (la principal) y cada [Impresora <nombre>]. Con bus o
+# serial se distinguen impresoras iguales (mismo vendor/product).
+def cargar_impresoras(config):
+    impresoras = {}
+    for seccion in config.sections():
+        if seccion == 'Impresora':
+            nombre = IMPRESORA_PRINCIPAL
+        elif seccion.startswith('Impresora '):
+            nombre = seccion[len('Impresora '):].strip()
+        else:
+            continue
+        datos = config[seccion]
+        bus = datos.get('bus')
+        impresoras[nombre] = {
+            'idvendor': int(datos['idvendor'], 16),
+            'idproduct': int(datos['idproduct'], 16),
+            'ancho': int(datos['ancho']),
+            # Perfil de python-escpos (opcional); cambia qué comandos soporta la impresora
+            'perfil': datos.get('perfil') or None,
+            'bus': int(bus) if bus else None,
+            'serial': datos.get('serial') or None,
+            # floyd, bayer o umbral (ver rasterizado.py)
+            'tramado': normalizar_tramado(datos.get('tramado')),
+        }
+    if IMPRESORA_PRINCIPAL not in impresoras:
+        raise KeyError('Impresora')
+    return impresoras
+
+
+# [Ruteo]: "pto_vta.<n> = <impresora>" o "tipo.<tipo> = <impresora>"
+def cargar_ruteo(config, impresoras):
+    ruteo = {}
+    if not config.has_section('Ruteo'):
+        return ruteo
+    for clave, nombre in config['Ruteo'].items():
+        nombre = nombre.strip()
+        if nombre not in impresoras:
+            logging.error(f"Ruteo '{clave}': la impresora '{nombre}' no está configurada, se usa la principal.")
+            continue
+        if clave.startswith('pto_vta.'):
+            clave = f"pto_vta.{normalizar_pto_vta(clave[len('pto_vta.'):])}"
+        ruteo[clave.strip().lower()] = nombre
+    return ruteo
+
+
+def normalizar_pto_vta(valor):
+    valor = str(valor).strip()
+    return str(int(valor)) if valor.isdigit() else valor.lower()
+
+
+# El listado trae el punto de venta en 'pto_vta'/'ptoVta'; si no, sale del
+# numero_completo ("0010-00001234")
+def punto_de_venta(comprobante):
+    valor = comprobante.get('pto_vta', comprobante.get('ptoVta'))
+    if valor is None:
+        numero_completo = str(comprobante.get('numero_completo', ''))
+        if '-' not in numero_completo:
+            return None
+        valor = numero_completo.split('-')[0]
+    return normalizar_pto_vta(valor)
@@ -0,0 +1,113 @@
+import logging
+
+# Conversión de imágenes a bytes ESC/POS (GS v 0) sin pasar por python-escpos.
+# Se pasa a escala de grises antes de reescalar (un canal en lugar de tres),
+# los JPEG se decodifican directamente a menor resolución con Image.draft y
+# el tramado y el empaquetado de bits se hacen con NumPy o con el código C de
+# Pillow, en lugar de recorrer la imagen en Python.
+
+# Modos de tramado:
+#  floyd:  Floyd-Steinberg (el de Pillow, igual que python-escpos). Mejor para fotos.
+#  bayer:  ordenado con matriz de Bayer 8x8. Sin "gusanos"; bueno para logos con degradé.
+#  umbral: blanco o negro puro. El más rápido; ideal para QR y logos de un color.
+TRAMADOS = ('floyd', 'bayer', 'umbral')
+TRAMADO_PREDETERMINADO = 'floyd'
+
+# Nivel de gris por debajo del cual un punto se imprime en modo umbral
+UMBRAL = 128
+
+# Alto máximo de cada comando GS v 0 (el mismo que usa python-escpos)
+ALTO_BANDA = 960
+
+BAYER_8X8 = (
+    (0, 32, 8, 40, 2, 34, 10, 42),
+    (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38),
+    (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41),
+    (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37),
+    (63, 31, 55, 23, 61, 29, 53, 21),
+)
+
+
+# Devuelve la imagen en escala de grises ('L'), derecha según EXIF, con el
+# fondo transparente en blanco y escalada a `ancho` puntos
+def preparar_imagen(imagen, ancho):
+    from PIL import Image, ImageOps
+
+    if imagen.format == 'JPEG':
+        # El decodificador reduce por 1/2, 1/4 o 1/8 sin pasar por la resolución completa
+        ancho_original, alto_original = imagen.size
+        if imagen.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            # Va a quedar girada 90°: el ancho final sale del alto original
+            pedido = (max(1, round(ancho * ancho_original / alto_original)), ancho)
+        else:
+            pedido = (ancho, max(1, round(ancho * alto_original / ancho_original)))
+        imagen.draft('L', pedido)
+    imagen = ImageOps.exif_transpose(imagen)
+
+    if imagen.mode in ('RGBA', 'LA', 'PA') or (imagen.mode == 'P' and 'transparency' in imagen.info):
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGBA', imagen.size, (255, 255, 255, 255))
+        imagen = Image.alpha_composite(fondo, imagen)
+    if imagen.mode != 'L':
+        imagen = imagen.convert('L')
+
+    alto = max(1, int(imagen.height * ancho / imagen.width))
+    if imagen.size != (ancho, alto):
+        lanczos = getattr(Image, 'Resampling', Image).LANCZOS
+        imagen = imagen.resize((ancho, alto), lanczos, reducing_gap=3.0)
+    return imagen
+
+
+# Imagen en grises -> filas de bits empaquetadas (1 = punto negro).
+# Devuelve (bytes por fila, filas, datos).
+def tramar(imagen, tramado=TRAMADO_PREDETERMINADO):
+    ancho_bytes = (imagen.width + 7) // 8
+    if tramado == 'floyd':
+        from PIL import ImageOps
+        # Invertida, el bit 1 de una imagen '1' de Pillow es un punto negro
+        return ancho_bytes, imagen.height, ImageOps.invert(imagen).convert('1').tobytes()
+
+    import numpy as np
+    pixeles = np.asarray(imagen, dtype=np.uint8)
+    if tramado == 'bayer':
+        matriz = (np.array(BAYER_8X8, dtype=np.float32) + 0.5) * (256 / 64)
+        repeticiones = (-(-pixeles.shape[0] // 8), -(-pixeles.shape[1] // 8))
+        umbrales = np.tile(matriz, repeticiones)[:pixeles.shape[0], :pixeles.shape[1]]
+        negros = pixeles < umbrales
+    else:
+        negros = pixeles < UMBRAL
+    # packbits completa cada fila con ceros hasta el byte
+    return ancho_bytes, imagen.height, np.packbits(negros, axis=1).tobytes()
+
+
+# Arma los comandos GS v 0, partiendo la imagen en bandas de ALTO_BANDA filas
+def comandos_raster(ancho_bytes, alto, datos):
+    comandos = bytearray()
+    for inicio in range(0, alto, ALTO_BANDA):
+        filas = min(ALTO_BANDA, alto - inicio)
+        comandos += b'\x1dv0\x00' + ancho_bytes.to_bytes(2, 'little') + filas.to_bytes(2, 'little')
+        comandos += datos[inicio * ancho_bytes:(inicio + filas) * ancho_bytes]
+    return bytes(comandos)
+
+
+def rasterizar(imagen, ancho, tramado=TRAMADO_PREDETERMINADO):
+    return comandos_raster(*tramar(preparar_imagen(imagen, ancho), tramado))
+
+
+# Valor de `tramado` en config.ini; si no es válido, o si es bayer/umbral y
+# NumPy no está instalado, se usa el predeterminado
+def normalizar_tramado(valor):
+    tramado = (valor or TRAMADO_PREDETERMINADO).strip().lower()
+    if tramado not in TRAMADOS:
+        logging.error(f"Tramado desconocido '{valor}', se usa {TRAMADO_PREDETERMINADO}.")
+        return TRAMADO_PREDETERMINADO
+    if tramado != 'floyd':
+        try:
+            import numpy
+        except ImportError:
+            logging.error(f"El tramado '{tramado}' necesita NumPy (pip install numpy), se usa {TRAMADO_PREDETERMINADO}.")
+            return TRAMADO_PREDETERMINADO
+    return tramado
@@ -0,0 +1,162 @@
+import os
+import glob
+import json
+import queue
+import atexit
+import hashlib
+import logging
+import configparser
+from datetime import date, datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from metricas import metricas
+
+ARCHIVO_REGISTRO = 'comprobante.log'
+# Rotación: al llegar a este tamaño o al cambiar el día se pasa a comprobante.log.1, .2, ...
+TAMANO_MAXIMO_MB = 5
+# Cuántos archivos rotados se guardan (el total en disco queda acotado a (ARCHIVOS + 1) * TAMANO_MAXIMO_MB)
+ARCHIVOS_REGISTRO = 5
+# Los mensajes más largos se recortan y se agrega el tamaño y un hash del original
+LARGO_MAXIMO = 2000
+# Registros en espera de escribirse; si se llena se descartan (y se avisa cuántos)
+TAMANO_COLA = 10000
+
+
+# Texto acotado a `maximo` caracteres. Si se recorta queda el principio, el
+# largo original y un sha1 para poder buscarlo (por ejemplo, en el diario).
+def recortar(texto, maximo=LARGO_MAXIMO):
+    texto = str(texto)
+    if len(texto) <= maximo:
+        return texto
+    huella = hashlib.sha1(texto.encode('utf-8', 'replace')).hexdigest()[:12]
+    return f"{texto[:maximo]}... [recortado: {len(texto)} caracteres, sha1 {huella}]"
+
+
+# Un registro por línea en JSON, con el comprobante que se estaba procesando en el hilo
+class FormatoJson(logging.Formatter):
+    def format(self, record):
+        registro = {
+            't': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'hilo': record.threadName,
+            'mensaje': record.getMessage(),
+        }
+        comprobante = getattr(record, 'comprobante', None)
+        if comprobante:
+            registro['comprobante'] = comprobante
+        return json.dumps(registro, ensure_ascii=False)
+
+
+# Como el texto de siempre, con el comprobante al final si lo hay
+class FormatoTexto(logging.Formatter):
+    def format(self, record):
+        texto = super().format(record)
+        comprobante = getattr(record, 'comprobante', None)
+        return f"{texto} [{comprobante}]" if comprobante else texto
+
+
+# Rota por tamaño (RotatingFileHandler) y además al empezar un día nuevo
+class ArchivoRotativo(RotatingFileHandler):
+    def __init__(self, archivo, tamano_maximo, archivos):
+        super().__init__(archivo, maxBytes=tamano_maximo, backupCount=archivos, encoding='utf-8', delay=True)
+        self._dia = self._dia_archivo()
+
+    def _dia_archivo(self):
+        try:
+            return date.fromtimestamp(os.path.getmtime(self.baseFilename))
+        except OSError:
+            return date.today()
+
+    def shouldRollover(self, record):
+        hoy = date.fromtimestamp(record.created)
+        if hoy != self._dia:
+            self._dia = hoy
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                return True
+        return super().shouldRollover(record)
+
+
+# Del lado de quien registra solo se arma el mensaje, se recorta y se encola;
+# formatear y escribir a disco lo hace el hilo de QueueListener. Si la cola se
+# llena (disco trabado) se descarta en lugar de frenar la impresión.
+class ColaRegistro(QueueHandler):
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record):
+        if not hasattr(record, 'comprobante'):
+            record.comprobante = metricas.comprobante()
+        record = super().prepare(record)
+        record.msg = record.message = recortar(record.msg)
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.descartados:
+                aviso = logging.makeLogRecord({'name': 'registro', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                               'msg': f"Se descartaron {self.descartados} registros con la cola llena."})
+                self.queue.put_nowait(aviso)
+                self.descartados = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+_escucha = None
+
+
+# Reemplaza a logging.basicConfig. Con `flujo` (servicio.py) se escribe ahí en
+# texto; si no, al archivo rotativo en JSON. Tamaño, cantidad de archivos y
+# formato del archivo se pueden cambiar en la sección [Registro] de config.ini.
+def configurar_registro(flujo=None, formato=None, nivel=logging.INFO):
+    global _escucha
+    if _escucha is not None:
+        return
+
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.getcwd(), 'config.ini'))
+    seccion = config['Registro'] if config.has_section('Registro') else {}
+    archivo = seccion.get('archivo', ARCHIVO_REGISTRO).strip() or ARCHIVO_REGISTRO
+    tamano_maximo = float(seccion.get('tamano_maximo_mb', TAMANO_MAXIMO_MB)) * 1024 * 1024
+    archivos = max(1, int(seccion.get('archivos', ARCHIVOS_REGISTRO)))
+    if formato is None:
+        formato = 'texto' if flujo is not None else seccion.get('formato', 'json').strip().lower()
+
+    if flujo is not None:
+        # El journal ya agrega fecha y hora
+        destino = logging.StreamHandler(flujo)
+        destino.setFormatter(FormatoJson() if formato == 'json' else
+                             FormatoTexto('%(levelname)s %(threadName)s: %(message)s'))
+    else:
+        destino = ArchivoRotativo(archivo, int(tamano_maximo), archivos)
+        destino.setFormatter(FormatoJson() if formato == 'json' else
+                             FormatoTexto('%(asctime)s %(levelname)s %(threadName)s: %(message)s'))
+
+    cola = queue.Queue(TAMANO_COLA)
+    raiz = logging.getLogger()
+    raiz.setLevel(nivel)
+    raiz.addHandler(ColaRegistro(cola))
+    _escucha = QueueListener(cola, destino, respect_handler_level=True)
+    _escucha.start()
+    # Al salir se escribe lo que quedó en la cola
+    atexit.register(detener_registro)
+    if flujo is None:
+        # Ya con el registro armado, por si hay que avisar que no se pudo borrar alguno
+        borrar_registros_anteriores()
+
+
+def detener_registro():
+    global _escucha
+    if _escucha is not None:
+        _escucha.stop()
+        _escucha = None
+
+
+# Los comprobante_AAAA-MM-DD.log de antes de la rotación, que solo se borraban de a uno
+def borrar_registros_anteriores():
+    for ruta in glob.glob('comprobante_????-??-??.log'):
+        try:
+            os.remove(ruta)
+        except OSError as e:
+            logging.warning(f"No se pudo borrar el registro anterior {ruta}: {e}")
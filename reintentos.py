@@ -0,0 +1,158 @@
+import time
+import random
+import threading
+
+# Disyuntor: fallos seguidos que lo abren y cuánto espera (creciente) antes de probar
+FALLOS_PARA_ABRIR = 3
+ESPERA_ABIERTO = 5
+ESPERA_ABIERTO_MAXIMA = 120
+
+# Reintentos de un comprobante: espera inicial, tope y cantidad de intentos
+ESPERA_REINTENTO = 2
+ESPERA_REINTENTO_MAXIMA = 300
+PRESUPUESTO_REINTENTOS = 8
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+
+# Disyuntor de un endpoint (el listado, los detalles, el servidor de una imagen).
+# Después de FALLOS_PARA_ABRIR errores seguidos se abre y los pedidos fallan
+# en el acto, sin tocar la red. Vencida la espera deja pasar un único pedido
+# de prueba: si sale bien se cierra, si no vuelve a abrirse con el doble de espera.
+# Si la prueba no informa ni éxito ni fallo, pasada otra espera se deja pasar otra.
+class Disyuntor:
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.estado = CERRADO
+        self.fallos = 0
+        self.espera = ESPERA_ABIERTO
+        self.proxima_prueba = 0
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            if self.estado == CERRADO:
+                return True
+            ahora = time.monotonic()
+            if ahora >= self.proxima_prueba:
+                self.estado = SEMIABIERTO
+                self.proxima_prueba = ahora + self.espera
+                return True
+            return False
+
+    # Devuelve True si el disyuntor cambió de estado
+    def exito(self):
+        with self._lock:
+            cambio = self.estado != CERRADO
+            self.estado = CERRADO
+            self.fallos = 0
+            self.espera = ESPERA_ABIERTO
+            return cambio
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            if self.estado == SEMIABIERTO:
+                self.espera = min(self.espera * 2, ESPERA_ABIERTO_MAXIMA)
+            elif self.estado == ABIERTO or self.fallos < FALLOS_PARA_ABRIR:
+                return False
+            self.estado = ABIERTO
+            self.proxima_prueba = time.monotonic() + self.espera
+            return True
+
+    # Abierto y todavía sin permitir la prueba: no tiene sentido intentar
+    def abierto(self):
+        with self._lock:
+            return self.estado == ABIERTO and time.monotonic() < self.proxima_prueba
+
+    # Deja pasar la prueba ya mismo, sin esperar a que venza la espera
+    def probar_ya(self):
+        with self._lock:
+            if self.estado != CERRADO:
+                self.proxima_prueba = 0
+
+    def descripcion(self):
+        with self._lock:
+            if self.estado == CERRADO:
+                return None
+            restante = max(0, self.proxima_prueba - time.monotonic())
+            return f"{self.nombre} sin respuesta, se prueba en {restante:.0f} s"
+
+
+# Reemplaza a los time.sleep de los reintentos. Nadie espera: lo que falla
+# queda agendado con espera exponencial (y algo de azar) y el que lo pidió
+# sigue con lo demás. El procesador consulta `listo` antes de volver a
+# intentar un comprobante; agotados los PRESUPUESTO_REINTENTOS intentos se
+# sigue reintentando cada ESPERA_REINTENTO_MAXIMA (el servicio no tiene
+# 'Reiniciar'). `reiniciar` vuelve a dar presupuesto a todo.
+# También guarda un Disyuntor por endpoint.
+class PlanificadorReintentos:
+    def __init__(self, presupuesto=PRESUPUESTO_REINTENTOS):
+        self.presupuesto = presupuesto
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._disyuntores = {}
+
+    def disyuntor(self, endpoint):
+        with self._lock:
+            disyuntor = self._disyuntores.get(endpoint)
+            if disyuntor is None:
+                disyuntor = self._disyuntores[endpoint] = Disyuntor(endpoint)
+            return disyuntor
+
+    # False mientras `clave` espera su próximo intento
+    def listo(self, clave):
+        with self._lock:
+            pendiente = self._pendientes.get(clave)
+            if pendiente is None:
+                return True
+            intentos, proximo = pendiente
+            return time.monotonic() >= proximo
+
+    # Agenda el próximo intento. Devuelve False si se agotó el presupuesto
+    # (desde ahí, un intento cada ESPERA_REINTENTO_MAXIMA).
+    def fallo(self, clave):
+        with self._lock:
+            intentos = self._pendientes.get(clave, (0, 0))[0] + 1
+            if intentos >= self.presupuesto:
+                espera = ESPERA_REINTENTO_MAXIMA + random.uniform(0, 1)
+            else:
+                espera = min(ESPERA_REINTENTO * 2 ** (intentos - 1), ESPERA_REINTENTO_MAXIMA) + random.uniform(0, 1)
+            self._pendientes[clave] = (intentos, time.monotonic() + espera)
+            return intentos < self.presupuesto
+
+    def exito(self, clave):
+        with self._lock:
+            self._pendientes.pop(clave, None)
+
+    # Vuelve a dar presupuesto a todo y deja probar ya los endpoints caídos
+    def reiniciar(self):
+        with self._lock:
+            self._pendientes.clear()
+            disyuntores = list(self._disyuntores.values())
+        for disyuntor in disyuntores:
+            disyuntor.probar_ya()
+
+    # Segundos hasta el próximo reintento agendado, o None si no hay ninguno
+    def proximo(self):
+        with self._lock:
+            proximos = [proximo for _, proximo in self._pendientes.values()]
+        if not proximos:
+            return None
+        return max(0, min(proximos) - time.monotonic())
+
+    # Texto para la interfaz; None si no hay nada fallando
+    def resumen(self):
+        with self._lock:
+            esperando = sum(1 for intentos, _ in self._pendientes.values() if intentos < self.presupuesto)
+            agotados = len(self._pendientes) - esperando
+            disyuntores = list(self._disyuntores.values())
+        partes = [d for d in (disyuntor.descripcion() for disyuntor in disyuntores) if d]
+        if esperando:
+            partes.append(f"{esperando} comprobantes esperando reintento")
+        if agotados:
+            partes.append(f"{agotados} sin imprimir tras {self.presupuesto} intentos "
+                          f"(se reintentan cada {ESPERA_REINTENTO_MAXIMA // 60} minutos)")
+        return '; '.join(partes) or None
@@ -0,0 +1,476 @@
+import os
+import sys
+import json
+import math
+import time
+import queue
+import random
+import shutil
+import base64
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import resource
+except ImportError:
+    # Windows: sin CPU ni RSS en el reporte
+    resource = None
+
+CARPETA_PROYECTO = os.path.dirname(os.path.abspath(__file__))
+
+PTO_VTA = '10'
+TIPOS_COMPROBANTE = ('texto', 'img', 'url', 'logo')
+# Cantidad de URLs distintas que aparecen en las líneas #url#
+IMAGENES_URL = 5
+
+
+# Banco de pruebas de rendimiento.
+# Levanta en otro proceso un servidor local que imita app-get-comprobantes.php,
+# app-get-comprobante.php (?id= y ?ids=), app-espera-comprobantes.php y
+# app-eventos-comprobantes.php, con demora, tasa de error y mezcla de
+# comprobantes configurables. Contra ese servidor corre el ProcesadorComprobantes
+# real (descarga, armado, diario y ColaImpresion) con una impresora en memoria
+# en lugar del USB, en una carpeta temporal con su propio config.ini.
+#
+#   python3 rendimiento.py --comprobantes 500 --ritmo 20 --mezcla texto=70,img=10,url=10,logo=10
+#   python3 rendimiento.py --rasterizado 10
+#
+# Reporta comprobantes por segundo, latencia p50/p99 desde que el comprobante
+# aparece en el listado hasta que se manda el corte, bytes por comprobante y
+# CPU/RSS del proceso (el servidor corre aparte y no se cuenta). Con --json
+# la salida se puede guardar y comparar entre versiones.
+
+
+# Qué comprobantes hay y cuándo aparecen en el listado. Es determinístico
+# dada la semilla, así el servidor y el banco lo calculan por separado.
+def generar_comprobantes(cantidad, ritmo, mezcla, semilla):
+    azar = random.Random(semilla)
+    tipos = list(mezcla)
+    pesos = [mezcla[tipo] for tipo in tipos]
+    comprobantes = []
+    for i in range(cantidad):
+        idcomprobante = 1000 + i
+        comprobantes.append({
+            'idcomprobante': idcomprobante,
+            'numero_completo': f"{int(PTO_VTA):04d}-{idcomprobante:08d}",
+            'tipo': azar.choices(tipos, pesos)[0],
+            # Segundos desde el inicio en que aparece en el listado
+            'aparece': i / ritmo if ritmo > 0 else 0,
+        })
+    return comprobantes
+
+
+def generar_detalle(comprobante, url_base, imagen_base64):
+    numero_completo = comprobante['numero_completo']
+    lineas = ["B;10;PAPELERA BARBIERI", f"N;0;Comprobante {numero_completo}", "N;0;" + "-" * 32]
+    if comprobante['tipo'] == 'logo':
+        lineas.insert(0, "#logo#")
+    for renglon in range(1, 16):
+        lineas.append(f"N;0;{renglon:>3} x Articulo de prueba {renglon:<10} ${renglon * 125:>8}.00")
+    lineas.append("B;5;TOTAL $ 15000.00")
+    if comprobante['tipo'] == 'img':
+        lineas.append(f"#img#{imagen_base64}")
+    elif comprobante['tipo'] == 'url':
+        lineas.append(f"#url#{url_base}imagenes/{comprobante['idcomprobante'] % IMAGENES_URL}.png")
+    lineas.append("N;0;Gracias por su compra")
+    return lineas
+
+
+class ServidorPrueba(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, opciones, inicio):
+        super().__init__(direccion, ManejadorPrueba)
+        self.opciones = opciones
+        self.inicio = inicio
+        self.url_base = f"http://127.0.0.1:{self.server_address[1]}/"
+        self.comprobantes = generar_comprobantes(opciones['comprobantes'], opciones['ritmo'],
+                                                 opciones['mezcla'], opciones['semilla'])
+        self.por_id = {str(c['idcomprobante']): c for c in self.comprobantes}
+        with open(os.path.join(CARPETA_PROYECTO, 'logo.png'), 'rb') as archivo:
+            self.imagen = archivo.read()
+        self.imagen_base64 = base64.b64encode(self.imagen).decode()
+        self.azar = random.Random(opciones['semilla'])
+        self._lock = threading.Lock()
+
+    def visibles(self, desde=None):
+        transcurrido = time.time() - self.inicio
+        return [c for c in self.comprobantes
+                if c['aparece'] <= transcurrido and (desde is None or c['idcomprobante'] > desde)]
+
+    def fallar(self):
+        with self._lock:
+            return self.azar.random() < self.opciones['tasa_error']
+
+
+class ManejadorPrueba(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        servidor = self.server
+        direccion = urlparse(self.path)
+        parametros = {clave: valores[0] for clave, valores in parse_qs(direccion.query).items()}
+        endpoint = direccion.path.rsplit('/', 1)[-1]
+        if servidor.opciones['latencia'] > 0:
+            time.sleep(servidor.opciones['latencia'])
+        if endpoint.endswith('.php') and servidor.fallar():
+            self.responder(500, b'error simulado', 'text/plain')
+            return
+
+        if endpoint == 'app-get-comprobantes.php':
+            desde = int(parametros['desde']) if 'desde' in parametros else None
+            self.responder_listado(servidor.visibles(desde))
+        elif endpoint == 'app-get-comprobante.php' and 'ids' in parametros:
+            documentos = []
+            for idcomprobante in parametros['ids'].split(','):
+                comprobante = servidor.por_id.get(idcomprobante)
+                if comprobante is not None:
+                    documentos.append(f"#comprobante#{idcomprobante}")
+                    documentos.extend(generar_detalle(comprobante, servidor.url_base, servidor.imagen_base64))
+            self.responder(200, '\r\n'.join(documentos).encode(), 'text/plain; charset=utf-8')
+        elif endpoint == 'app-get-comprobante.php':
+            comprobante = servidor.por_id.get(parametros.get('id', ''))
+            if comprobante is None:
+                self.responder(404, b'', 'text/plain')
+                return
+            detalle = generar_detalle(comprobante, servidor.url_base, servidor.imagen_base64)
+            self.responder(200, '\r\n'.join(detalle).encode(), 'text/plain; charset=utf-8')
+        elif endpoint == 'app-espera-comprobantes.php':
+            self.responder_espera(parametros)
+        elif endpoint == 'app-eventos-comprobantes.php':
+            self.responder_eventos()
+        elif direccion.path.startswith('/imagenes/'):
+            self.responder(200, servidor.imagen, 'image/png')
+        elif direccion.path == '/app/logo.jpg':
+            with open(os.path.join(CARPETA_PROYECTO, 'logo.jpg'), 'rb') as archivo:
+                self.responder(200, archivo.read(), 'image/jpeg')
+        else:
+            self.responder(404, b'', 'text/plain')
+
+    def responder_listado(self, comprobantes):
+        listado = [{'idcomprobante': str(c['idcomprobante']), 'numero_completo': c['numero_completo']}
+                   for c in comprobantes]
+        self.responder(200, json.dumps(listado).encode(), 'application/json')
+
+    # Long-polling: retiene el pedido hasta que aparece algo posterior a `desde`
+    def responder_espera(self, parametros):
+        desde = int(parametros['desde']) if 'desde' in parametros else None
+        limite = time.time() + float(parametros.get('espera', 25))
+        while time.time() < limite:
+            nuevos = self.server.visibles(desde)
+            if nuevos:
+                self.responder_listado(nuevos)
+                return
+            time.sleep(0.05)
+        self.responder(204, b'', 'text/plain')
+
+    # SSE: un evento por cada comprobante que aparece, hasta que se corta la conexión
+    def responder_eventos(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        avisados = len(self.server.visibles())
+        try:
+            while True:
+                visibles = self.server.visibles()
+                for comprobante in visibles[avisados:]:
+                    self.wfile.write(f"id: {comprobante['idcomprobante']}\ndata: {comprobante['numero_completo']}\n\n".encode())
+                if len(visibles) == avisados:
+                    self.wfile.write(b": espera\n\n")
+                self.wfile.flush()
+                avisados = len(visibles)
+                time.sleep(0.05 if avisados < len(self.server.comprobantes) else 5)
+        except OSError:
+            pass
+        self.close_connection = True
+
+    def responder(self, codigo, cuerpo, tipo):
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def correr_servidor(opciones, inicio, puerto):
+    servidor = ServidorPrueba(('127.0.0.1', 0), opciones, inicio)
+    puerto.put(servidor.server_address[1])
+    servidor.serve_forever()
+
+
+# Impresora en memoria que registra cuántos bytes recibe. Con
+# `bytes_por_segundo` simula además la velocidad de una térmica.
+def crear_impresora_medida(ancho, perfil, bytes_por_segundo, enviados):
+    from impresora import ImpresoraVirtual
+
+    class ImpresoraMedida(ImpresoraVirtual):
+        def enviar(self, datos, tamano_bloque=None):
+            if bytes_por_segundo > 0:
+                time.sleep(len(datos) / bytes_por_segundo)
+            enviados.append(len(datos))
+
+    return ImpresoraMedida(ancho, perfil)
+
+
+# Reemplaza a SesionImpresora: siempre conectada, sin USB
+class SesionVirtual:
+    def __init__(self, impresora):
+        self.impresora = impresora
+        self.conectada = True
+
+    def obtener(self):
+        return self.impresora
+
+    def presente(self):
+        return True
+
+    def invalidar(self, motivo=''):
+        pass
+
+    def cerrar(self):
+        pass
+
+
+def escribir_configuracion(carpeta, url_base, opciones):
+    with open(os.path.join(carpeta, 'config.ini'), 'w') as archivo:
+        archivo.write(f"""[General]
+url_base = {url_base}
+frecuencia_actualizacion = {opciones['frecuencia']}
+pto_vta = {PTO_VTA}
+dias_a_eliminar = 15
+descargas_anticipadas = {opciones['descargas_anticipadas']}
+tamano_lote = {opciones['tamano_lote']}
+procesos_armado = {opciones['procesos_armado']}
+intervalo_listado_completo = 300
+reimprimir_interrumpidos = no
+transporte = {opciones['transporte']}
+[Impresora]
+idvendor = 28e9
+idproduct = 0289
+ancho = {opciones['ancho']}
+tramado = {opciones['tramado']}
+""")
+
+
+def percentil(valores, porcentaje):
+    if not valores:
+        return None
+    # Rango más cercano
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(porcentaje / 100 * len(ordenados)) - 1)]
+
+
+def uso_recursos():
+    if resource is None:
+        return None, None
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss viene en KiB en Linux y en bytes en macOS
+    rss = uso.ru_maxrss / 1024 if sys.platform != 'darwin' else uso.ru_maxrss / 1024 / 1024
+    return uso.ru_utime + uso.ru_stime, rss
+
+
+def correr(opciones):
+    carpeta = tempfile.mkdtemp(prefix='ticketprint-rendimiento-')
+    carpeta_anterior = os.getcwd()
+    # El servidor arranca un poco después para que el procesador ya esté andando
+    inicio = time.time() + 1
+    puerto = multiprocessing.Queue()
+    servidor = multiprocessing.Process(target=correr_servidor, args=(opciones, inicio, puerto), daemon=True)
+    servidor.start()
+    try:
+        url_base = f"http://127.0.0.1:{puerto.get(timeout=10)}/"
+        escribir_configuracion(carpeta, url_base, opciones)
+        shutil.copy(os.path.join(CARPETA_PROYECTO, 'logo.jpg'), carpeta)
+        os.chdir(carpeta)
+        sys.path.insert(0, CARPETA_PROYECTO)
+
+        from procesador import ProcesadorComprobantes
+        from cola_impresion import ColaImpresion
+        cpu_inicial, _ = uso_recursos()
+
+        procesador = ProcesadorComprobantes(reinicio_automatico=True)
+        enviados = []
+        for nombre, datos in procesador.impresoras.items():
+            sesion = SesionVirtual(crear_impresora_medida(datos['ancho'], datos['perfil'],
+                                                          opciones['bytes_por_segundo'], enviados))
+            procesador.sesiones_impresora[nombre] = sesion
+            procesador.colas_impresion[nombre] = ColaImpresion(sesion, procesador.diario, procesador.eventos, nombre)
+
+        comprobantes = generar_comprobantes(opciones['comprobantes'], opciones['ritmo'],
+                                            opciones['mezcla'], opciones['semilla'])
+        aparece = {c['numero_completo']: inicio + c['aparece'] for c in comprobantes}
+        impresos = {}
+        errores = 0
+        procesador.iniciar()
+        limite = time.time() + opciones['limite']
+        while len(impresos) < len(comprobantes) and time.time() < limite:
+            try:
+                tipo, mensaje = procesador.eventos.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if tipo == 'impreso':
+                impresos.setdefault(mensaje, time.time())
+            elif tipo == 'error':
+                errores += 1
+        procesador.detener(timeout=5)
+        cpu_final, rss = uso_recursos()
+    finally:
+        os.chdir(carpeta_anterior)
+        servidor.terminate()
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+    latencias = [(impresos[numero] - aparece[numero]) * 1000 for numero in impresos if numero in aparece]
+    duracion = (max(impresos.values()) - inicio) if impresos else None
+    return {
+        'comprobantes': len(comprobantes),
+        'impresos': len(impresos),
+        'errores': errores,
+        'duracion_s': duracion,
+        'comprobantes_por_segundo': len(impresos) / duracion if duracion else None,
+        'latencia_p50_ms': percentil(latencias, 50),
+        'latencia_p99_ms': percentil(latencias, 99),
+        'bytes_por_comprobante': sum(enviados) / len(enviados) if enviados else None,
+        'cpu_s': cpu_final - cpu_inicial if cpu_final is not None else None,
+        'cpu_ms_por_comprobante': (cpu_final - cpu_inicial) * 1000 / len(impresos) if cpu_final is not None and impresos else None,
+        'rss_max_mb': rss,
+        'opciones': {clave: valor for clave, valor in opciones.items()},
+    }
+
+
+# Camino de imágenes anterior a rasterizado.py: reescalado a color y
+# conversión a 1 bit y empaquetado dentro de python-escpos
+def rasterizar_con_escpos(contenido, ancho):
+    from io import BytesIO, StringIO
+    from contextlib import redirect_stdout
+    from PIL import Image, ImageOps
+    from escpos.printer import Dummy
+
+    imagen = ImageOps.exif_transpose(Image.open(BytesIO(contenido)))
+    alto = int(imagen.height * ancho / float(imagen.width))
+    imagen = imagen.resize((ancho, alto), getattr(Image, 'Resampling', Image).LANCZOS)
+    raster = Dummy()
+    # python-escpos avisa por stdout que el perfil no tiene ancho
+    with redirect_stdout(StringIO()):
+        raster.image(imagen)
+    return raster.output
+
+
+# Compara el tiempo de rasterizado (mejor de `repeticiones`) del camino
+# anterior contra cada tramado de rasterizado.py, con logo.jpg, logo.png y
+# una foto grande como las que llegan por #url#
+def comparar_rasterizado(ancho, repeticiones):
+    from io import BytesIO
+    from PIL import Image
+    from rasterizado import TRAMADOS, rasterizar
+
+    imagenes = {}
+    for nombre in ('logo.jpg', 'logo.png'):
+        with open(os.path.join(CARPETA_PROYECTO, nombre), 'rb') as archivo:
+            imagenes[nombre] = archivo.read()
+    foto = Image.merge('RGB', (Image.linear_gradient('L').resize((2400, 1800)),
+                               Image.radial_gradient('L').resize((2400, 1800)),
+                               Image.effect_noise((2400, 1800), 40)))
+    salida = BytesIO()
+    foto.save(salida, 'JPEG', quality=90)
+    imagenes['foto 2400x1800.jpg'] = salida.getvalue()
+
+    caminos = {'escpos (anterior)': lambda contenido: rasterizar_con_escpos(contenido, ancho)}
+    for tramado in TRAMADOS:
+        caminos[tramado] = lambda contenido, tramado=tramado: rasterizar(Image.open(BytesIO(contenido)), ancho, tramado)
+
+    resultado = {}
+    for nombre, contenido in imagenes.items():
+        resultado[nombre] = {}
+        for camino, funcion in caminos.items():
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                datos = funcion(contenido)
+                tiempos.append(time.perf_counter() - inicio)
+            resultado[nombre][camino] = {'ms': min(tiempos) * 1000, 'bytes': len(datos)}
+    return resultado
+
+
+def imprimir_comparacion(resultado):
+    for nombre, caminos in resultado.items():
+        print(nombre)
+        base = caminos['escpos (anterior)']['ms']
+        for camino, medida in caminos.items():
+            print(f"  {camino:<18} {medida['ms']:8.2f} ms  {medida['bytes']:>7} bytes  x{base / medida['ms']:.1f}")
+
+
+def leer_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(','):
+        tipo, _, peso = parte.partition('=')
+        tipo = tipo.strip()
+        if tipo not in TIPOS_COMPROBANTE:
+            raise argparse.ArgumentTypeError(f"tipo de comprobante desconocido: {tipo}")
+        mezcla[tipo] = float(peso or 1)
+    return mezcla
+
+
+def imprimir_reporte(resultado):
+    def valor(clave, formato):
+        return formato.format(resultado[clave]) if resultado[clave] is not None else '-'
+
+    print(f"Comprobantes impresos:   {resultado['impresos']}/{resultado['comprobantes']} ({resultado['errores']} errores)")
+    print(f"Duración:                {valor('duracion_s', '{:.2f}')} s")
+    print(f"Comprobantes/segundo:    {valor('comprobantes_por_segundo', '{:.2f}')}")
+    print(f"Latencia listado-corte:  p50 {valor('latencia_p50_ms', '{:.1f}')} ms, p99 {valor('latencia_p99_ms', '{:.1f}')} ms")
+    print(f"Bytes por comprobante:   {valor('bytes_por_comprobante', '{:.0f}')}")
+    print(f"CPU:                     {valor('cpu_s', '{:.2f}')} s ({valor('cpu_ms_por_comprobante', '{:.2f}')} ms por comprobante)")
+    print(f"RSS máximo:              {valor('rss_max_mb', '{:.1f}')} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de pruebas de rendimiento de TicketPrint")
+    parser.add_argument('--comprobantes', type=int, default=200)
+    parser.add_argument('--ritmo', type=float, default=20, help="comprobantes nuevos por segundo (0 = todos al inicio)")
+    parser.add_argument('--mezcla', type=leer_mezcla, default=leer_mezcla('texto=70,img=10,url=10,logo=10'))
+    parser.add_argument('--latencia', type=float, default=0.02, help="demora del servidor por pedido, en segundos")
+    parser.add_argument('--tasa-error', type=float, default=0, help="proporción de pedidos que responden 500")
+    parser.add_argument('--transporte', choices=('polling', 'longpoll', 'sse'), default='polling')
+    parser.add_argument('--frecuencia', type=int, default=1, help="frecuencia_actualizacion, en segundos")
+    parser.add_argument('--descargas-anticipadas', type=int, default=4)
+    parser.add_argument('--tamano-lote', type=int, default=20)
+    parser.add_argument('--procesos-armado', type=int, default=0)
+    parser.add_argument('--ancho', type=int, default=400)
+    parser.add_argument('--tramado', choices=('floyd', 'bayer', 'umbral'), default='floyd')
+    parser.add_argument('--bytes-por-segundo', type=float, default=0, help="velocidad simulada de la impresora (0 = sin límite)")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--limite', type=float, default=300, help="segundos máximos de la corrida")
+    parser.add_argument('--json', action='store_true', help="salida en JSON")
+    parser.add_argument('--rasterizado', type=int, metavar='REPETICIONES', default=0,
+                        help="solo compara el rasterizado anterior contra rasterizado.py")
+    argumentos = parser.parse_args()
+
+    if argumentos.rasterizado:
+        resultado = comparar_rasterizado(argumentos.ancho, argumentos.rasterizado)
+        if argumentos.json:
+            print(json.dumps(resultado, indent=2))
+        else:
+            imprimir_comparacion(resultado)
+        return
+
+    opciones = {clave: valor for clave, valor in vars(argumentos).items() if clave not in ('json', 'rasterizado')}
+    resultado = correr(opciones)
+    if argumentos.json:
+        print(json.dumps(resultado, indent=2))
+    else:
+        imprimir_reporte(resultado)
+    if resultado['impresos'] < resultado['comprobantes']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
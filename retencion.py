@@ -0,0 +1,145 @@
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+CARPETA_ARCHIVO = 'archivo_comprobantes'
+
+# Cada cuánto corre la limpieza
+INTERVALO_RETENCION = 600
+# Cuánto se borra o compacta por tanda, y la pausa entre tandas para no
+# acaparar el diario mientras el procesador lo usa
+TAMANO_TANDA = 200
+PAUSA_TANDA = 0.05
+# Pasados estos días, el cuerpo de un comprobante impreso se mueve al archivo comprimido
+DIAS_COMPACTAR = 1
+
+
+# Mantenimiento del diario en un hilo propio, fuera del ciclo de consulta.
+# Cada INTERVALO_RETENCION segundos:
+#  - borra del diario lo impreso hace más de `dias` días (lo pendiente o fallido
+#    es la cola de impresión y se queda), usando el índice por fecha;
+#  - compacta: el cuerpo de lo impreso hace más de `dias_compactar` días pasa
+#    a un archivo gzip por día (archivo_comprobantes/AAAA-MM-DD.jsonl.gz) y
+#    en el diario queda solo la fila, que sigue sirviendo para no reimprimir;
+#  - borra los archivos diarios vencidos (uno por día, sin recorrer comprobantes);
+#  - vacía de a poco la carpeta de .txt que se usaba antes del diario, una vez migrada.
+# Todo va por tandas de TAMANO_TANDA con una pausa entre una y otra, así el
+# costo de cada pasada depende de lo vencido y no del tamaño del archivo.
+class Retencion:
+    def __init__(self, diario, dias, dias_compactar=DIAS_COMPACTAR, carpeta_archivo=CARPETA_ARCHIVO,
+                 carpeta_anterior=None, intervalo=INTERVALO_RETENCION):
+        self.diario = diario
+        self.dias = dias
+        self.dias_compactar = dias_compactar
+        self.carpeta_archivo = carpeta_archivo
+        self.carpeta_anterior = carpeta_anterior
+        self.intervalo = intervalo
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._correr, name="retencion", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=None):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def _correr(self):
+        while not self._detener.is_set():
+            try:
+                self.ejecutar()
+            except Exception as e:
+                logging.error(f"Error en la limpieza de comprobantes antiguos: {e}")
+            self._detener.wait(self.intervalo)
+
+    def ejecutar(self):
+        # Primero lo vencido, así no se compacta algo que se borra enseguida
+        eliminados = self.eliminar_vencidos()
+        compactados = self.compactar()
+        archivos = self.eliminar_archivos_vencidos()
+        anteriores = self.limpiar_carpeta_anterior()
+        if compactados or eliminados or archivos or anteriores:
+            logging.info(f"Retención: {compactados} comprobantes compactados, {eliminados} eliminados del diario, "
+                         f"{archivos} archivos diarios y {anteriores} .txt anteriores eliminados.")
+
+    def compactar(self):
+        limite = time.time() - self.dias_compactar * 86400
+        total = 0
+        while not self._detener.is_set():
+            filas = self.diario.para_compactar(limite, TAMANO_TANDA)
+            if not filas:
+                break
+            por_dia = {}
+            for numero_completo, idcomprobante, creado, detalle in filas:
+                dia = datetime.fromtimestamp(creado).date().isoformat()
+                por_dia.setdefault(dia, []).append({'numero_completo': numero_completo, 'idcomprobante': idcomprobante,
+                                                    'creado': creado, 'detalle': detalle})
+            os.makedirs(self.carpeta_archivo, exist_ok=True)
+            for dia, comprobantes in por_dia.items():
+                # Cada tanda agrega un miembro gzip al archivo del día; se lee de corrido con gzip.open
+                with gzip.open(self._ruta_archivo(dia), 'at', encoding='utf-8') as archivo:
+                    for comprobante in comprobantes:
+                        archivo.write(json.dumps(comprobante, ensure_ascii=False) + '\n')
+            # Si se corta acá, la próxima pasada puede repetir alguno en el archivo, nunca perderlo
+            self.diario.compactados([fila[0] for fila in filas])
+            total += len(filas)
+            self._detener.wait(PAUSA_TANDA)
+        return total
+
+    def eliminar_vencidos(self):
+        limite = time.time() - self.dias * 86400
+        total = 0
+        while not self._detener.is_set():
+            eliminados = self.diario.eliminar_antiguos(limite, TAMANO_TANDA)
+            total += eliminados
+            if eliminados < TAMANO_TANDA:
+                break
+            self._detener.wait(PAUSA_TANDA)
+        return total
+
+    # Un archivo por día: alcanza con mirar los nombres
+    def eliminar_archivos_vencidos(self):
+        if not os.path.isdir(self.carpeta_archivo):
+            return 0
+        limite = (date.today() - timedelta(days=self.dias)).isoformat()
+        total = 0
+        for entrada in os.scandir(self.carpeta_archivo):
+            dia = entrada.name.split('.', 1)[0]
+            if entrada.name.endswith('.jsonl.gz') and dia < limite:
+                try:
+                    os.remove(entrada.path)
+                    total += 1
+                except OSError as e:
+                    logging.error(f"No se pudo borrar el archivo {entrada.path}: {e}")
+        return total
+
+    # Los .txt de antes ya están en el diario: se borran de a TAMANO_TANDA por pasada
+    def limpiar_carpeta_anterior(self):
+        if not self.carpeta_anterior or not os.path.isdir(self.carpeta_anterior) or not self.diario.migrado():
+            return 0
+        total = 0
+        with os.scandir(self.carpeta_anterior) as entradas:
+            for entrada in entradas:
+                if total >= TAMANO_TANDA or self._detener.is_set():
+                    return total
+                if entrada.is_file() and entrada.name.endswith('.txt'):
+                    os.remove(entrada.path)
+                    total += 1
+        try:
+            os.rmdir(self.carpeta_anterior)
+            logging.info(f"Carpeta {self.carpeta_anterior} vacía, eliminada.")
+        except OSError:
+            pass
+        return total
+
+    def _ruta_archivo(self, dia):
+        return os.path.join(self.carpeta_archivo, f"{dia}.jsonl.gz")
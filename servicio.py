@@ -0,0 +1,72 @@
+import time
+
+# Lo primero: desde acá se mide el arranque
+INICIO = time.monotonic()
+
+import sys
+import queue
+import signal
+import logging
+import threading
+
+from impresora import precargar_modulos
+from procesador import ProcesadorComprobantes
+from registro import configurar_registro
+
+# Cada cuánto se revisa la cola de eventos cuando no llega nada
+INTERVALO_EVENTOS = 1
+
+
+# Punto de entrada sin interfaz, para correr como servicio de systemd.
+# No importa tkinter ni pystray; el registro va a la salida estándar (el
+# journal ya agrega fecha y hora) y los eventos del procesador se vuelcan
+# ahí mismo. Ante un error inesperado el procesador se reinicia solo.
+class Servicio:
+    def __init__(self):
+        self.procesador = ProcesadorComprobantes(reinicio_automatico=True)
+        self._detener = threading.Event()
+        self.primer_impreso = False
+
+    def correr(self):
+        signal.signal(signal.SIGTERM, self.salir)
+        signal.signal(signal.SIGINT, self.salir)
+        self.procesador.iniciar()
+        logging.info(f"Servicio iniciado en {time.monotonic() - INICIO:.3f} segundos.")
+        while not self._detener.is_set():
+            try:
+                tipo, mensaje = self.procesador.eventos.get(timeout=INTERVALO_EVENTOS)
+            except queue.Empty:
+                continue
+            self.atender_evento(tipo, mensaje)
+        self.procesador.detener(timeout=10)
+        logging.info("Servicio detenido.")
+
+    def atender_evento(self, tipo, mensaje):
+        if tipo == 'impreso':
+            if not self.primer_impreso:
+                self.primer_impreso = True
+                logging.info(f"Primer comprobante impreso a los {time.monotonic() - INICIO:.3f} segundos del arranque.")
+        elif tipo == 'impresora':
+            nombre, conexion = mensaje
+            logging.info(f"Impresora {nombre}: {conexion}")
+        elif tipo == 'reintentos':
+            logging.warning(f"Reintentos: {mensaje}" if mensaje else "Reintentos: nada pendiente.")
+        elif tipo == 'error':
+            logging.error(mensaje)
+        else:
+            logging.info(mensaje)
+
+    def salir(self, signum=None, frame=None):
+        self._detener.set()
+
+
+def main():
+    # A la salida estándar, pero desde un hilo aparte: si el journal se atrasa no frena la impresión
+    configurar_registro(flujo=sys.stdout)
+    # Pillow, python-escpos y pyusb se importan mientras se pide el primer listado
+    threading.Thread(target=precargar_modulos, name="precarga", daemon=True).start()
+    Servicio().correr()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from diario import DiarioImpresion, PENDIENTE, ENVIANDO, IMPRESO, FALLIDO
+
+
+@pytest.fixture
+def diario(tmp_path):
+    diario = DiarioImpresion(str(tmp_path / 'comprobantes.db'))
+    yield diario
+    diario.cerrar()
+
+
+def estado(diario, numero_completo):
+    filas = diario._ejecutar("SELECT estado FROM comprobantes WHERE numero_completo = ?", (numero_completo,))
+    return filas[0][0] if filas else None
+
+
+def test_recorrido_completo(diario):
+    diario.encolar('FA-1', 1, 'detalle', b'datos', 'principal')
+    assert estado(diario, 'FA-1') == PENDIENTE
+    assert diario.siguiente_en_cola('principal') == ('FA-1', b'datos')
+    assert diario.iniciar_envio('FA-1')
+    assert estado(diario, 'FA-1') == ENVIANDO
+    assert diario.confirmar_impresion('FA-1')
+    assert estado(diario, 'FA-1') == IMPRESO
+    assert diario.siguiente_en_cola('principal') is None
+    assert diario.cantidad_impresos() == 1
+
+
+def test_solo_avanza_desde_el_estado_esperado(diario):
+    diario.encolar('FA-1', 1, 'detalle', b'datos', 'principal')
+    # Sin tomarlo para enviar no se puede confirmar ni marcar fallido
+    assert not diario.confirmar_impresion('FA-1')
+    assert not diario.marcar_fallido('FA-1')
+    assert diario.iniciar_envio('FA-1')
+    # Un segundo envío del mismo comprobante no lo toma
+    assert not diario.iniciar_envio('FA-1')
+    assert diario.marcar_fallido('FA-1')
+    assert estado(diario, 'FA-1') == FALLIDO
+    # Fallido vuelve a la cola
+    assert diario.siguiente_en_cola('principal') == ('FA-1', b'datos')
+    assert diario.iniciar_envio('FA-1')
+    assert diario.confirmar_impresion('FA-1')
+    assert not diario.iniciar_envio('FA-1')
+
+
+def test_registrar_y_encolar_no_pisan_lo_impreso(diario):
+    diario.encolar('FA-1', 1, 'detalle', b'datos', 'principal')
+    diario.iniciar_envio('FA-1')
+    diario.confirmar_impresion('FA-1')
+    diario.registrar('FA-1', 1, FALLIDO)
+    diario.encolar('FA-1', 1, 'detalle', b'otros', 'principal')
+    assert estado(diario, 'FA-1') == IMPRESO
+    assert diario.resuelto('FA-1')
+    assert diario.nuevos([{'numero_completo': 'FA-1'}, {'numero_completo': 'FA-2'}]) == [{'numero_completo': 'FA-2'}]
+
+
+def test_recuperar_tras_un_corte(tmp_path):
+    ruta = str(tmp_path / 'comprobantes.db')
+    diario = DiarioImpresion(ruta)
+    diario.encolar('FA-1', 1, 'detalle', b'uno', 'principal')
+    diario.encolar('FA-2', 2, 'detalle', b'dos', 'principal')
+    diario.iniciar_envio('FA-1')
+    diario.iniciar_envio('FA-2')
+    # Se corta sin confirmar: al abrir de nuevo siguen 'enviando'
+    diario.cerrar()
+
+    diario = DiarioImpresion(ruta)
+    assert estado(diario, 'FA-1') == ENVIANDO
+    assert sorted(diario.recuperar()) == ['FA-1', 'FA-2']
+    assert estado(diario, 'FA-1') == IMPRESO
+    assert diario.siguiente_en_cola('principal') is None
+    assert diario.recuperar() == []
+    diario.cerrar()
+
+
+def test_recuperar_reimprimiendo(diario):
+    diario.encolar('FA-1', 1, 'detalle', b'uno', 'principal')
+    diario.iniciar_envio('FA-1')
+    assert diario.recuperar(reimprimir=True) == ['FA-1']
+    assert estado(diario, 'FA-1') == PENDIENTE
+    assert diario.siguiente_en_cola('principal') == ('FA-1', b'uno')
+
+
+def test_eliminar_antiguos_respeta_la_cola(diario):
+    diario.encolar('FA-1', 1, 'detalle', b'uno', 'principal')
+    diario.encolar('FA-2', 2, 'detalle', b'dos', 'principal')
+    diario.iniciar_envio('FA-2')
+    diario.confirmar_impresion('FA-2')
+    assert diario.eliminar_antiguos(time.time() + 1) == 1
+    assert estado(diario, 'FA-2') is None
+    assert diario.siguiente_en_cola('principal') == ('FA-1', b'uno')
@@ -0,0 +1,43 @@
+import pytest
+
+from detalle import Texto, Corte, separar_lineas
+from procesador import leer_documentos
+
+
+def documentos(cuerpo, tamano_trozo=7):
+    trozos = [cuerpo[i:i + tamano_trozo] for i in range(0, len(cuerpo), tamano_trozo)]
+    return list(leer_documentos(separar_lineas(trozos)))
+
+
+def test_lote_completo():
+    recibidos = documentos(b"#comprobante#10\r\nB;1;Hola\r\n#fin#\r\n#comprobante#11\r\nN;0;Chau\r\n")
+    assert [idcomprobante for idcomprobante, _ in recibidos] == ['10', '11']
+    primero = recibidos[0][1].validas()
+    assert isinstance(primero[0], Texto) and primero[0].texto == 'Hola'
+    assert isinstance(primero[1], Corte)
+    assert recibidos[1][1].validas()[0].texto == 'Chau'
+
+
+def test_lote_parcial():
+    # Faltan comprobantes pedidos: solo sale lo que vino, el resto se pide de a uno
+    recibidos = documentos(b"#comprobante#10\r\nB;1;Hola\r\n")
+    assert [idcomprobante for idcomprobante, _ in recibidos] == ['10']
+
+
+def test_lote_cortado_a_mitad_de_linea():
+    recibidos = documentos(b"#comprobante#10\r\nB;1;Hola\r\n#comprobante#11\r\nB;1")
+    assert [idcomprobante for idcomprobante, _ in recibidos] == ['10', '11']
+    assert recibidos[0][1].validas()[0].texto == 'Hola'
+    # La línea incompleta deja inválido solo a ese comprobante
+    with pytest.raises(ValueError):
+        recibidos[1][1].validas()
+
+
+def test_formato_desconocido():
+    # Un servidor que no entiende ?ids= devuelve un detalle suelto
+    with pytest.raises(ValueError):
+        documentos(b"B;1;Hola\r\n#fin#\r\n")
+
+
+def test_respuesta_vacia():
+    assert documentos(b"") == []
@@ -0,0 +1,115 @@
+import pytest
+
+import reintentos
+from reintentos import (Disyuntor, PlanificadorReintentos, CERRADO, ABIERTO, SEMIABIERTO, FALLOS_PARA_ABRIR,
+                        ESPERA_ABIERTO, ESPERA_REINTENTO_MAXIMA)
+
+
+# Reloj que solo avanza cuando el test lo pide
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+    def avanzar(self, segundos):
+        self.ahora += segundos
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(reintentos.time, 'monotonic', reloj)
+    return reloj
+
+
+def abrir(disyuntor):
+    for _ in range(FALLOS_PARA_ABRIR):
+        disyuntor.fallo()
+
+
+def test_disyuntor_abre_prueba_y_cierra(reloj):
+    disyuntor = Disyuntor('servidor')
+    for _ in range(FALLOS_PARA_ABRIR - 1):
+        assert not disyuntor.fallo()
+    assert disyuntor.fallo()
+    assert disyuntor.estado == ABIERTO
+    assert disyuntor.abierto()
+    assert not disyuntor.permitir()
+
+    reloj.avanzar(ESPERA_ABIERTO)
+    assert disyuntor.permitir()
+    assert disyuntor.estado == SEMIABIERTO
+    # Una sola prueba a la vez
+    assert not disyuntor.permitir()
+    assert disyuntor.exito()
+    assert disyuntor.estado == CERRADO
+    assert disyuntor.permitir()
+
+
+def test_disyuntor_prueba_fallida_duplica_la_espera(reloj):
+    disyuntor = Disyuntor('servidor')
+    abrir(disyuntor)
+    reloj.avanzar(ESPERA_ABIERTO)
+    assert disyuntor.permitir()
+    assert disyuntor.fallo()
+    assert disyuntor.estado == ABIERTO
+    reloj.avanzar(ESPERA_ABIERTO)
+    assert not disyuntor.permitir()
+    reloj.avanzar(ESPERA_ABIERTO)
+    assert disyuntor.permitir()
+
+
+def test_disyuntor_prueba_sin_resultado_no_lo_traba(reloj):
+    disyuntor = Disyuntor('servidor')
+    abrir(disyuntor)
+    reloj.avanzar(ESPERA_ABIERTO)
+    assert disyuntor.permitir()
+    # La prueba nunca informa exito ni fallo
+    assert not disyuntor.permitir()
+    reloj.avanzar(ESPERA_ABIERTO)
+    assert disyuntor.permitir()
+
+
+def test_disyuntor_probar_ya(reloj):
+    disyuntor = Disyuntor('servidor')
+    abrir(disyuntor)
+    disyuntor.probar_ya()
+    assert disyuntor.permitir()
+    assert not disyuntor.permitir()
+    disyuntor.probar_ya()
+    assert disyuntor.permitir()
+
+
+def test_reintentos_con_espera_creciente(reloj):
+    planificador = PlanificadorReintentos(presupuesto=4)
+    assert planificador.listo('FA-1')
+    esperas = []
+    for _ in range(3):
+        assert planificador.fallo('FA-1')
+        assert not planificador.listo('FA-1')
+        esperas.append(planificador.proximo())
+        reloj.avanzar(esperas[-1])
+        assert planificador.listo('FA-1')
+    assert esperas == sorted(esperas)
+    planificador.exito('FA-1')
+    assert planificador.proximo() is None
+    assert planificador.resumen() is None
+
+
+def test_reintentos_agotado_el_presupuesto(reloj):
+    planificador = PlanificadorReintentos(presupuesto=2)
+    assert planificador.fallo('FA-1')
+    assert not planificador.fallo('FA-1')
+    # Agotado, se sigue reintentando cada ESPERA_REINTENTO_MAXIMA
+    assert ESPERA_REINTENTO_MAXIMA <= planificador.proximo() <= ESPERA_REINTENTO_MAXIMA + 1
+    assert 'sin imprimir tras 2 intentos' in planificador.resumen()
+    reloj.avanzar(ESPERA_REINTENTO_MAXIMA + 1)
+    assert planificador.listo('FA-1')
+    assert not planificador.fallo('FA-1')
+    assert not planificador.listo('FA-1')
+
+    planificador.reiniciar()
+    assert planificador.listo('FA-1')
+    assert planificador.fallo('FA-1')
@@ -0,0 +1,82 @@
+import pytest
+
+from transporte import EscuchaLongPoll, EscuchaSSE
+
+
+class Respuesta:
+    def __init__(self, estado=200, lineas=(), json=None):
+        self.status_code = estado
+        self.lineas = lineas
+        self._json = json
+        self.headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, chunk_size=512, decode_unicode=False):
+        return iter(self.lineas)
+
+    def json(self):
+        return self._json
+
+
+class Sesion:
+    def __init__(self, respuesta):
+        self.respuesta = respuesta
+        self.pedidos = []
+
+    def get(self, url, **opciones):
+        self.pedidos.append((url, opciones))
+        return self.respuesta
+
+    def close(self):
+        pass
+
+
+def escucha(clase, respuesta):
+    avisos = []
+    escucha = clase('http://servidor/', 10, lambda: avisos.append(1))
+    escucha.session = Sesion(respuesta)
+    return escucha, avisos
+
+
+def test_sse_un_aviso_por_evento():
+    lineas = [': keep-alive', '', 'id: 7', 'data: {"id": 7}', '', 'id: 8', 'data: a', 'data: b', '', ': fin']
+    sse, avisos = escucha(EscuchaSSE, Respuesta(lineas=lineas))
+    sse.escuchar()
+    assert len(avisos) == 2
+    assert sse.ultimo_evento == '8'
+    assert sse.activo
+
+    # Al reconectar se manda el último id recibido
+    sse.escuchar()
+    assert sse.session.pedidos[-1][1]['headers']['Last-Event-ID'] == '8'
+
+
+def test_longpoll_avisa_y_recuerda_lo_visto():
+    longpoll, avisos = escucha(EscuchaLongPoll, Respuesta(json=[{'idcomprobante': '5'}, {'idcomprobante': '9'}]))
+    longpoll.escuchar()
+    assert avisos == [1]
+    assert longpoll.ultimo_visto == 9
+    assert 'desde=' not in longpoll.session.pedidos[-1][0]
+
+
+def test_longpoll_respuesta_inmediata_sin_novedades_es_fallo():
+    longpoll, avisos = escucha(EscuchaLongPoll, Respuesta(estado=204))
+    with pytest.raises(ValueError):
+        longpoll.escuchar()
+    assert not longpoll.activo
+
+    # Lo mismo si repite comprobantes ya avisados
+    longpoll.ultimo_visto = 9
+    longpoll.session.respuesta = Respuesta(json=[{'idcomprobante': '9'}])
+    with pytest.raises(ValueError):
+        longpoll.escuchar()
+    assert 'desde=9' in longpoll.session.pedidos[-1][0]
+    assert avisos == []
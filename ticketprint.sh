@@ -1 +1 @@
-/usr/bin/python3 /home/sc3/Documentos/Python/TicketPrint/ticketprint.py
+/usr/bin/python3 /home/sc3/Documentos/Python/TicketPrint/servicio.py
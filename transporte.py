@@ -0,0 +1,199 @@
+import time
+import random
+import logging
+import threading
+
+import requests
+
+# Parámetro con el que se le pide al servidor solo lo posterior al cursor
+PARAMETRO_CURSOR = 'desde'
+
+# Endpoints que acompañan a app-get-comprobantes.php
+ENDPOINT_LONGPOLL = 'app-espera-comprobantes.php'
+ENDPOINT_SSE = 'app-eventos-comprobantes.php'
+
+# Cuánto retiene el servidor un pedido de long-polling sin novedades
+ESPERA_LONGPOLL = 25
+# Una respuesta sin novedades antes de este tiempo quiere decir que el
+# servidor no está reteniendo el pedido: cuenta como fallo, así se espera
+# cada vez más entre pedidos y, si sigue, se vuelve al polling normal
+ESPERA_MINIMA_LONGPOLL = ESPERA_LONGPOLL / 2
+# Sin ningún evento (ni comentario de keep-alive) en este tiempo, se reconecta
+ESPERA_SSE = 60
+ESPERA_MAXIMA_RECONEXION = 30
+# Fallos seguidos a partir de los cuales se vuelve al polling normal
+FALLOS_PARA_DEGRADAR = 3
+
+
+# Escucha avisos del servidor en un hilo propio y llama a `al_haber_novedades`
+# cuando hay comprobantes nuevos. No descarga nada: el procesador hace el
+# listado incremental de siempre, solo que sin esperar al próximo ciclo.
+# `activo` indica si la conexión está funcionando; si no, el procesador
+# sigue consultando cada `frecuencia_actualizacion` segundos.
+# Cada transporte (ver TRANSPORTES) define `nombre` y `escuchar`, que atiende
+# una conexión hasta que se corta o vence.
+class EscuchaNovedades:
+    pausa_reconexion = 0
+
+    def __init__(self, url_base, pto_vta, al_haber_novedades, obtener_cursor=None, al_cambiar_estado=None):
+        self.url_base = url_base
+        self.pto_vta = pto_vta
+        self.al_haber_novedades = al_haber_novedades
+        self.obtener_cursor = obtener_cursor
+        self.al_cambiar_estado = al_cambiar_estado
+        self.activo = False
+        self.session = requests.Session()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._correr, name=f"escucha-{self.nombre}", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self.session.close()
+
+    def _correr(self):
+        fallos = 0
+        while not self._detener.is_set():
+            try:
+                self.escuchar()
+                fallos = 0
+                self._detener.wait(self.pausa_reconexion)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if self._detener.is_set():
+                    break
+                fallos += 1
+                if fallos >= FALLOS_PARA_DEGRADAR:
+                    self._cambiar_estado(False)
+                espera = min(2 ** fallos, ESPERA_MAXIMA_RECONEXION) + random.uniform(0, 1)
+                logging.error(f"Error en la conexión {self.nombre}: {e}. Reconectando en {espera:.2f} segundos...")
+                self._detener.wait(espera)
+        self._cambiar_estado(False)
+
+    def _cambiar_estado(self, activo):
+        if activo == self.activo:
+            return
+        self.activo = activo
+        if self.al_cambiar_estado is not None:
+            self.al_cambiar_estado(activo)
+
+    def _url(self, endpoint, desde=None):
+        url = f"{self.url_base}{endpoint}?ptoVta={self.pto_vta}"
+        if desde is not None:
+            url += f"&{PARAMETRO_CURSOR}={desde}"
+        return url
+
+
+# El servidor retiene el pedido hasta que aparece un comprobante posterior a
+# `desde` (responde la lista, como app-get-comprobantes.php) o hasta que
+# vence la espera (responde 204 o una lista vacía). Una respuesta vacía o
+# sin nada posterior a `desde` que llega enseguida es un fallo (ver
+# ESPERA_MINIMA_LONGPOLL).
+class EscuchaLongPoll(EscuchaNovedades):
+    nombre = 'longpoll'
+    pausa_reconexion = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ultimo_visto = None
+
+    def escuchar(self):
+        desde = self.ultimo_visto
+        if self.obtener_cursor is not None:
+            cursor = self.obtener_cursor()
+            if cursor is not None and (desde is None or cursor > desde):
+                desde = cursor
+        url = self._url(ENDPOINT_LONGPOLL, desde) + f"&espera={ESPERA_LONGPOLL}"
+        inicio = time.monotonic()
+        response = self.session.get(url, timeout=(10, ESPERA_LONGPOLL + 10))
+        inmediata = time.monotonic() - inicio < ESPERA_MINIMA_LONGPOLL
+        if response.status_code == 204:
+            if inmediata:
+                raise ValueError("el servidor respondió sin novedades y sin esperar")
+            self._cambiar_estado(True)
+            return
+        response.raise_for_status()
+        comprobantes = response.json()
+        # Se recuerda lo ya avisado para no volver a recibirlo mientras el
+        # procesador no haya avanzado su cursor
+        nuevos = False
+        for comprobante in comprobantes or ():
+            try:
+                idcomprobante = int(comprobante.get('idcomprobante'))
+            except (TypeError, ValueError):
+                # Sin número no se puede saber si es viejo: se avisa, como antes
+                nuevos = True
+                continue
+            if desde is None or idcomprobante > desde:
+                nuevos = True
+            if self.ultimo_visto is None or idcomprobante > self.ultimo_visto:
+                self.ultimo_visto = idcomprobante
+        if not nuevos:
+            if inmediata:
+                raise ValueError("el servidor respondió sin comprobantes nuevos y sin esperar")
+            self._cambiar_estado(True)
+            return
+        self._cambiar_estado(True)
+        self.al_haber_novedades()
+
+
+# Server-Sent Events: una conexión abierta por la que el servidor manda un
+# evento por cada comprobante nuevo. Los comentarios (": ...") sirven de
+# keep-alive. Al reconectar se manda Last-Event-ID.
+class EscuchaSSE(EscuchaNovedades):
+    nombre = 'sse'
+    pausa_reconexion = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ultimo_evento = None
+
+    def escuchar(self):
+        encabezados = {'Accept': 'text/event-stream', 'Cache-Control': 'no-cache'}
+        if self.ultimo_evento:
+            encabezados['Last-Event-ID'] = self.ultimo_evento
+        url = self._url(ENDPOINT_SSE)
+        with self.session.get(url, headers=encabezados, stream=True, timeout=(10, ESPERA_SSE)) as response:
+            response.raise_for_status()
+            self._cambiar_estado(True)
+            datos = []
+            # chunk_size=1: con el valor por defecto (512) un evento corto queda
+            # retenido hasta que lleguen más bytes
+            for linea in response.iter_lines(chunk_size=1, decode_unicode=True):
+                if self._detener.is_set():
+                    return
+                if not linea:
+                    # Línea vacía: termina el evento
+                    if datos:
+                        datos = []
+                        self.al_haber_novedades()
+                    continue
+                if linea.startswith(':'):
+                    continue
+                campo, _, valor = linea.partition(':')
+                valor = valor[1:] if valor.startswith(' ') else valor
+                if campo == 'data':
+                    datos.append(valor)
+                elif campo == 'id':
+                    self.ultimo_evento = valor
+
+
+TRANSPORTES = {
+    'longpoll': EscuchaLongPoll,
+    'sse': EscuchaSSE,
+}
+
+
+# Devuelve la escucha para el transporte configurado, o None para 'polling'
+def crear_escucha(transporte, *args, **kwargs):
+    if transporte in ('', 'polling'):
+        return None
+    if transporte not in TRANSPORTES:
+        logging.error(f"Transporte desconocido '{transporte}', se usa polling.")
+        return None
+    return TRANSPORTES[transporte](*args, **kwargs)
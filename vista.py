@@ -0,0 +1,154 @@
+import tkinter as tk
+import tkinter.font as tkfont
+from collections import deque
+from datetime import datetime
+
+from procesador import IMPRESORA_PRINCIPAL
+
+# Mensajes que se conservan en la ventana; los más viejos se descartan
+MAX_MENSAJES = 500
+# Como mucho un redibujo cada tantos milisegundos (4 por segundo)
+INTERVALO_REDIBUJO = 250
+
+
+# Los últimos MAX_MENSAJES mensajes en un buffer circular, volcados a un
+# widget Text de a tandas. `agregar` no toca el widget: solo guarda y agenda
+# un redibujo; en el redibujo entran todos los mensajes nuevos con un solo
+# insert, se recortan las líneas de arriba que sobran y se baja al final una
+# sola vez. Con la ventana oculta (en la bandeja o minimizada) no se
+# redibuja; al volver a mostrarse (<Map>) se vuelca lo que haya en el buffer.
+class RegistroMensajes:
+    def __init__(self, texto, maximo=MAX_MENSAJES):
+        self.texto = texto
+        self.maximo = maximo
+        self._mensajes = deque(maxlen=maximo)
+        self._sin_mostrar = 0
+        self._agendado = None
+        texto.winfo_toplevel().bind('<Map>', lambda evento: self.mostrar_pendientes(), add='+')
+
+    def agregar(self, mensaje, etiqueta='neutro'):
+        self._mensajes.append((mensaje, etiqueta))
+        self._sin_mostrar += 1
+        self._agendar()
+
+    def _agendar(self):
+        if self._agendado is None:
+            self._agendado = self.texto.after(INTERVALO_REDIBUJO, self.redibujar)
+
+    def redibujar(self):
+        self._agendado = None
+        if not self._sin_mostrar or not self.texto.winfo_viewable():
+            return
+        nuevos = min(self._sin_mostrar, len(self._mensajes))
+        self._sin_mostrar = 0
+        if nuevos >= self.maximo:
+            # Entró más de lo que cabe: se reemplaza todo el contenido
+            self.texto.delete('1.0', tk.END)
+        partes = []
+        for mensaje, etiqueta in list(self._mensajes)[-nuevos:]:
+            partes += [mensaje + '\n', etiqueta]
+        self.texto.insert(tk.END, *partes)
+        # El Text siempre termina con un '\n' propio: 'end-1c' cae en la línea vacía final
+        sobrantes = int(self.texto.index('end-1c').split('.')[0]) - 1 - self.maximo
+        if sobrantes > 0:
+            self.texto.delete('1.0', f'{sobrantes + 1}.0')
+        self.texto.yview(tk.END)
+
+    # La ventana volvió a mostrarse: se vuelca lo que se juntó mientras tanto
+    def mostrar_pendientes(self):
+        if self._sin_mostrar:
+            self._agendar()
+
+
+# Lista de comprobantes impresos leída del diario, lo último arriba.
+# El Listbox solo tiene las filas que entran en pantalla: la barra de
+# desplazamiento se maneja a mano sobre el total del diario y cada movimiento
+# pide esa página (LIMIT/OFFSET sobre el índice de impresos). La consulta no
+# corre en el hilo de Tk: `pedir(desde, cantidad)` la encarga al procesador
+# (pedir_impresos) y la página llega como evento 'impresos', que se pasa a
+# `mostrar`. Hay como mucho un pedido en vuelo; lo que se pida mientras tanto
+# se junta en uno solo. Los avisos de 'impreso' solo agendan un refresco,
+# como mucho uno por INTERVALO_REDIBUJO.
+class ListaImpresos:
+    def __init__(self, padre, pedir, filas=10):
+        self.pedir = pedir
+        self.desde = 0
+        self.total = 0
+        self._agendado = None
+        self._esperando = False
+        self._otra_vez = False
+
+        self.marco = tk.Frame(padre)
+        self.lista = tk.Listbox(self.marco, height=filas, activestyle='none')
+        self.barra = tk.Scrollbar(self.marco, orient=tk.VERTICAL, command=self.desplazar)
+        self.barra.pack(side=tk.RIGHT, fill=tk.Y)
+        self.lista.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self._alto_fila = tkfont.nametofont(self.lista.cget('font')).metrics('linespace') + 1
+
+        self.lista.bind('<Configure>', lambda evento: self.avisar())
+        # Lo que se imprimió con la ventana oculta se ve al volver a mostrarla
+        self.lista.winfo_toplevel().bind('<Map>', lambda evento: self.avisar(), add='+')
+        self.lista.bind('<MouseWheel>', self._rueda)
+        self.lista.bind('<Button-4>', lambda evento: self._mover(-3))
+        self.lista.bind('<Button-5>', lambda evento: self._mover(3))
+
+    def pack(self, **opciones):
+        self.marco.pack(**opciones)
+
+    # Hay un impreso nuevo (o cambió el tamaño): se refresca en la próxima tanda
+    def avisar(self):
+        if self._agendado is None:
+            self._agendado = self.lista.after(INTERVALO_REDIBUJO, self.refrescar)
+
+    def filas_visibles(self):
+        return max(1, self.lista.winfo_height() // self._alto_fila)
+
+    def refrescar(self):
+        self._agendado = None
+        if not self.lista.winfo_viewable():
+            return
+        if self._esperando:
+            self._otra_vez = True
+            return
+        self._esperando = True
+        self.pedir(self.desde, self.filas_visibles())
+
+    # Llegó la página pedida (evento 'impresos' del procesador)
+    def mostrar(self, desde, total, filas):
+        self._esperando = False
+        self.total = total
+        if self._otra_vez:
+            # Mientras tanto se movió la barra o hubo impresos nuevos
+            self._otra_vez = False
+            self.refrescar()
+            return
+        self.desde = desde
+        self.lista.delete(0, tk.END)
+        self.lista.insert(tk.END, *(self.texto_fila(*fila) for fila in filas))
+        if self.total:
+            self.barra.set(self.desde / self.total, (self.desde + len(filas)) / self.total)
+        else:
+            self.barra.set(0, 1)
+
+    def texto_fila(self, numero_completo, impreso, impresora):
+        hora = datetime.fromtimestamp(impreso).strftime('%d/%m %H:%M:%S')
+        if impresora and impresora != IMPRESORA_PRINCIPAL:
+            return f"{numero_completo}   {hora}   ({impresora})"
+        return f"{numero_completo}   {hora}"
+
+    # Comando de la barra: ('moveto', fraccion) o ('scroll', n, 'units' | 'pages')
+    def desplazar(self, accion, cantidad, unidad=None):
+        if accion == 'moveto':
+            self.desde = int(float(cantidad) * self.total)
+            self.refrescar()
+        elif accion == 'scroll':
+            filas = int(cantidad) * (self.filas_visibles() if unidad == 'pages' else 1)
+            self._mover(filas)
+
+    def _mover(self, filas):
+        self.desde = max(0, self.desde + filas)
+        self.refrescar()
+        return 'break'
+
+    def _rueda(self, evento):
+        return self._mover(-3 if evento.delta > 0 else 3)